@@ -0,0 +1,678 @@
+# Benchmarks for the TV Shows API in z5207370.py
+#
+# Usage: python benchmark.py <benchmark>|all [--sizes 1000,100000,1000000] [--repeat 1000]
+#                                            [--upstream-latency 0.02] [--server]
+#                                            [--concurrency 1] [--no-cache] [--output results.json]
+#
+# For every size, a throwaway SQLite database is seeded with the same synthetic TV shows
+# and the benchmarks drive the handlers through the Flask test client, or with --server
+# through a real multi-threaded HTTP server. Imports and refreshes are served by a local
+# stub of the tvmaze API, so no network access is needed. Results (latency percentiles,
+# throughput and peak RSS) are printed as JSON along with the revision they were run on.
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+import z5207370 as service
+
+GENRES = ['Drama', 'Comedy', 'Action', 'Crime', 'Thriller', 'Science-Fiction', 'Horror',
+          'Romance', 'Family', 'Fantasy', 'Mystery', 'Anime', 'Music', 'History']
+LANGUAGES = ['English', 'Japanese', 'Korean', 'Spanish', 'French', 'German', None]
+STATUSES = ['Running', 'Ended', 'To Be Determined', 'In Development']
+TYPES = ['Scripted', 'Animation', 'Reality', 'Documentary', 'Talk Show']
+
+# Time every seeded TV show was last updated: 2020-01-01 00:00:00 local time, in epoch seconds
+SEED_UPDATE = int(time.mktime((2020, 1, 1, 0, 0, 0, 0, 0, -1)))
+
+# Generate a synthetic TV show row in storage order, followed by its normalised name
+def make_show(id, rng):
+    name = 'Show {} {}'.format(id, rng.choice(['Rising', 'Returns', 'Chronicles', 'Nights']))
+    schedule = {'time': '{:02d}:00'.format(rng.randrange(24)), 'days': [rng.choice(['Monday', 'Friday'])]}
+    network = {'id': rng.randrange(500), 'name': 'Network', 'country': {'name': 'Australia', 'code': 'AU',
+                                                                       'timezone': 'Australia/Sydney'}}
+    return (
+        id + 1,
+        id,
+        SEED_UPDATE,
+        name,
+        rng.choice(TYPES),
+        rng.choice(LANGUAGES),
+        json.dumps(rng.sample(GENRES, rng.randrange(4))),
+        rng.choice(STATUSES),
+        rng.choice([None, 30, 45, 60]),
+        '{}-{:02d}-01'.format(rng.randrange(1960, 2021), rng.randrange(1, 13)),
+        None,
+        json.dumps(schedule),
+        rng.choice([None, round(rng.uniform(1, 10), 1)]),
+        rng.randrange(100),
+        json.dumps(network),
+        '<p>Summary of {}</p>'.format(name),
+        service.normalise_name(name)
+    )
+
+# Generate a TV show as returned by the tvmaze API
+def make_tvmaze_show(tvmaze_id, name):
+    return {
+        'id': tvmaze_id,
+        'name': name,
+        'type': 'Scripted',
+        'language': 'English',
+        'genres': ['Drama', 'Thriller'],
+        'status': 'Running',
+        'runtime': 60,
+        'premiered': '2015-06-01',
+        'officialSite': 'http://example.com/' + str(tvmaze_id),
+        'schedule': {'time': '21:00', 'days': ['Sunday']},
+        'rating': {'average': 8.2},
+        'weight': 90,
+        'network': {'id': 1, 'name': 'Network', 'country': {'name': 'Australia', 'code': 'AU',
+                                                            'timezone': 'Australia/Sydney'}},
+        'summary': '<p>Summary of {}</p>'.format(name)
+    }
+
+# Local stand-in for the tvmaze API: a search returns one TV show named after the query
+# and a TV show looked up by id is returned in its current (made-up) state
+class StubTvmazeHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body without waiting for delayed ACKs on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        # Simulate the network round trip to the real API
+        time.sleep(self.server.latency)
+        url = urllib.parse.urlsplit(self.path)
+        if (url.path == '/search/shows'):
+            name = urllib.parse.parse_qs(url.query)['q'][0]
+            body = [{'score': 1.0, 'show': make_tvmaze_show(abs(hash(name)) % 10 ** 8, name)}]
+            status = 200
+        elif url.path.startswith('/shows/'):
+            tvmaze_id = int(url.path[len('/shows/'):])
+            body = make_tvmaze_show(tvmaze_id, 'Show {}'.format(tvmaze_id))
+            status = 200
+        else:
+            body = {'message': 'Not found'}
+            status = 404
+        body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+# Start the stub tvmaze API in a background thread and return the server and its URL
+def start_stub_tvmaze(latency):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubTvmazeHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+# Insert 'count' synthetic TV shows in one transaction
+def seed(conn, count, rng_seed=0):
+    rng = random.Random(rng_seed)
+    columns = service.SHOW_COLUMNS + ['name_key']
+    query = 'insert into TV_Shows (' + ', '.join(columns) + ')\
+             values (' + ', '.join('?' * len(columns)) + ')'
+    with service.transaction(conn):
+        conn.executemany(query, (make_show(id, rng) for id in range(count)))
+        conn.execute("update Sequences set value = ? where name = 'TV_Shows'", (count - 1,))
+
+# Point the service at a new database in 'directory' seeded with 'count' TV shows
+def open_database(directory, count):
+    path = os.path.join(directory, 'shows-{}.db'.format(count))
+    service.pool = service.ConnectionPool(path)
+    with service.pool.connection() as conn:
+        service.init_db(conn)
+        seed(conn, count)
+    # Responses cached from the previous database must not be served
+    service.invalidate_responses()
+    return path
+
+# Sends requests through the Flask test client, one client for each thread
+class TestClient:
+
+    def __init__(self):
+        self._local = threading.local()
+
+    # Send a request and return the response status and body
+    def request(self, method, path, query=None, body=None):
+        if not hasattr(self._local, 'client'):
+            self._local.client = service.app.test_client()
+        response = self._local.client.open(path, method=method, query_string=query, json=body)
+        data = response.get_data()
+        # Closing the response runs the hooks that record request metrics
+        response.close()
+        return response.status_code, data
+
+# Sends requests to a real server, over one keep-alive connection for each thread
+class HTTPClient:
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self._local = threading.local()
+
+    def request(self, method, path, query=None, body=None):
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        if query:
+            path += '?' + urllib.parse.urlencode(query)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        self._local.connection.request(method, path, body=body, headers=headers)
+        response = self._local.connection.getresponse()
+        return response.status, response.read()
+
+# Request handler keeping connections alive without logging every request
+class QuietRequestHandler(WSGIRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, code='-', size='-'):
+        pass
+
+# Serve the app from a multi-threaded HTTP server in a background thread
+def start_server():
+    server = make_server('127.0.0.1', 0, service.app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, HTTPClient('127.0.0.1', server.server_port)
+
+# Summarise a list of latencies in seconds as milliseconds
+def summarise(samples):
+    samples = sorted(samples)
+    return {
+        'requests': len(samples),
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 4),
+        'p50_ms': round(samples[len(samples) // 2] * 1000, 4),
+        'p99_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 4)
+    }
+
+# Peak resident set size of this process so far, in megabytes
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+# Send 'requests', given as (method, path, query, body, expected status) tuples, from
+# 'concurrency' threads sharing them round-robin; return the latency percentiles and throughput
+def run_requests(client, requests, concurrency=1):
+    requests = list(requests)
+    samples = [None] * len(requests)
+
+    def send(offset):
+        for index in range(offset, len(requests), concurrency):
+            method, path, query, body, expected = requests[index]
+            start = time.perf_counter()
+            status, data = client.request(method, path, query, body)
+            samples[index] = time.perf_counter() - start
+            if (status != expected):
+                raise AssertionError('{} {} returned {}: {}'.format(method, path, status, data[:200]))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for sending in [executor.submit(send, offset) for offset in range(concurrency)]:
+            sending.result()
+    seconds = time.perf_counter() - start
+    result = summarise(samples)
+    result['requests_per_second'] = round(len(requests) / seconds, 1)
+    return result
+
+# Time 'requests' after sending the first 'warm_up' of them untimed, to fill the
+# connection pool and the prepared statement caches
+def measure(client, requests, options, warm_up=1):
+    requests = list(requests)
+    if warm_up:
+        run_requests(client, requests[:warm_up])
+    return run_requests(client, requests, options.concurrency)
+
+def get(path, query=None, expected=200):
+    return ('GET', path, query, None, expected)
+
+# Run in a fresh interpreter: import the service, serve one GET /tv-shows/<id>, and report
+# the time both took, the RSS after it and which of the heavy libraries were loaded
+STARTUP_SCRIPT = '''
+import json, resource, sys, time
+start = time.perf_counter()
+import z5207370
+imported = time.perf_counter()
+status = z5207370.app.test_client().get('/tv-shows/0').status_code
+served = time.perf_counter()
+# The resident set now, as the peak (ru_maxrss) is carried over from the parent process
+try:
+    with open('/proc/self/status') as status_file:
+        rss_kb = int([line for line in status_file if line.startswith('VmRSS:')][0].split()[1])
+except OSError:
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({
+    'status': status,
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'rss_mb': rss_kb / 1024,
+    'heavy_modules': [name for name in ['pandas', 'numpy', 'matplotlib'] if name in sys.modules]
+}))
+'''
+
+# Start the service in 'repeat' (at most 10) fresh interpreters, as when a worker is spawned,
+# and report the medians of the import time, the first request time and the RSS after it
+def bench_startup(size, options, client):
+    env = dict(os.environ, TV_SHOWS_DATABASE=service.pool.database)
+    directory = os.path.dirname(os.path.abspath(service.__file__))
+    runs = []
+    for i in range(min(options.repeat, 10)):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, cwd=directory,
+                                capture_output=True, text=True, check=True).stdout
+        run = json.loads(output)
+        assert run['status'] == 200
+        runs.append(run)
+
+    def median(field):
+        return round(sorted(run[field] for run in runs)[len(runs) // 2], 1)
+
+    return {
+        'runs': len(runs),
+        'import_ms': median('import_ms'),
+        'first_request_ms': median('first_request_ms'),
+        'rss_mb': median('rss_mb'),
+        'heavy_modules': runs[-1]['heavy_modules']
+    }
+
+# GET /tv-shows/<id> for random ids, including the first and last show
+def bench_get_by_id(size, options, client):
+    rng = random.Random(1)
+    ids = [0, size - 1] + [rng.randrange(size) for i in range(options.repeat - 2)]
+    return measure(client, [get('/tv-shows/' + str(id)) for id in ids], options)
+
+# GET /tv-shows?ids= for 100 random ids at a time, compared with the same TV shows fetched one by one
+def bench_multi_get(size, options, client):
+    rng = random.Random(1)
+    batches = [[rng.randrange(size) for i in range(100)] for j in range(options.repeat)]
+    return {
+        'batch_size': 100,
+        'multi': measure(client, [get('/tv-shows', {'ids': ','.join(map(str, ids))}) for ids in batches], options),
+        'single': measure(client, [get('/tv-shows/' + str(id)) for id in batches[0]], options)
+    }
+
+# Decode a matching TV show from tvmaze search results the way find_show did before
+# ShowRecord, as the baseline of the decode benchmark
+def pandas_find_show(results, name):
+    df = pd.DataFrame(results)
+    df = df.join(df['show'].apply(pd.Series))
+    name_reformatted = service.normalise_name(name)
+    df_name_copy = df[['id', 'name']].copy()
+    df_name_copy.columns = ['id', 'name_old']
+    df['name'] = df['name'].apply(service.normalise_name)
+    df = df[df['name'] == name_reformatted]
+    df = df.merge(df_name_copy, on='id')
+    if (df.shape[0] == 0):
+        return None
+    df = df[['id', 'name_old', 'type', 'language', 'genres', 'status', 'runtime', 'premiered',
+             'officialSite', 'schedule', 'rating', 'weight', 'network', 'summary']].iloc[0].to_frame().transpose()
+    df.columns = ['tvmaze_id', 'name', 'type', 'language', 'genres', 'status', 'runtime', 'premiered',
+                  'officialSite', 'schedule', 'rating', 'weight', 'network', 'summary']
+    df['tvmaze_id'] = int(df['tvmaze_id'].iloc[0])
+    if not pd.isna(df['runtime'].iloc[0]):
+        df['runtime'] = int(df['runtime'].iloc[0])
+    if not pd.isna(df['weight'].iloc[0]):
+        df['weight'] = int(df['weight'].iloc[0])
+    for field in ['genres', 'schedule', 'network']:
+        df[field] = df[field].apply(json.dumps)
+    df['rating'] = df['rating'].apply(lambda x: x['average'])
+    df['name_key'] = name_reformatted
+    return {field: None if pd.isna(value) else getattr(value, 'item', lambda: value)()
+            for field, value in df.iloc[0].items()}
+
+# Time 'decode' over each of 'inputs' and trace the memory it allocates
+def time_decode(decode, inputs):
+    start = time.perf_counter()
+    for args in inputs:
+        decode(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    for args in inputs[:100]:
+        decode(*args)
+    allocated = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        'us_per_show': round(seconds / len(inputs) * 1e6, 1),
+        'peak_traced_kb': round(allocated / 1024, 1)
+    }
+
+# Decode single TV shows from 10-result tvmaze searches and from TV_Shows rows, with the
+# old pandas code and with ShowRecord
+def bench_decode(size, options, client):
+    searches = []
+    for i in range(options.repeat):
+        results = [{'score': 1 - j / 10, 'show': make_tvmaze_show(i * 10 + j, 'Decode {} {}'.format(i, j))}
+                   for j in range(10)]
+        searches.append((results, 'decode {} 3'.format(i)))
+    expected = service.ShowRecord.from_tvmaze(searches[0][0][3]['show']).values()
+    del expected['id'], expected['last_update']
+    assert pandas_find_show(*searches[0]) == expected
+
+    def record_find_show(results, name):
+        for result in results:
+            if (service.normalise_name(result['show']['name']) == service.normalise_name(name)):
+                return service.ShowRecord.from_tvmaze(result['show'])
+
+    rng = random.Random(1)
+    ids = [(rng.randrange(size),) for i in range(options.repeat)]
+    with service.pool.connection() as conn:
+        def pandas_row(id):
+            return pd.read_sql_query('select * from TV_Shows where id=' + str(id), con=conn)
+
+        def record_row(id):
+            return service.ShowRecord.from_row(conn.execute(service.SHOW_QUERY, (id,)).fetchone())
+
+        return {
+            'search_pandas': time_decode(pandas_find_show, searches),
+            'search_record': time_decode(record_find_show, searches),
+            'row_pandas': time_decode(pandas_row, ids),
+            'row_record': time_decode(record_row, ids)
+        }
+
+# Import 'repeat' new TV shows one request at a time
+def bench_import(size, options, client):
+    names = ['Single Import {} {}'.format(size, i) for i in range(options.repeat)]
+    requests = [('POST', '/tv-shows/import', {'name': name}, None, 201) for name in names]
+    return measure(client, requests, options, warm_up=0)
+
+# Queue 'repeat' new TV show imports, then wait for the import jobs to finish
+def bench_import_async(size, options, client):
+    names = ['Async Import {} {}'.format(size, i) for i in range(options.repeat)]
+    requests = [('POST', '/tv-shows/import', {'name': name, 'async': 'true'}, None, 202) for name in names]
+    start = time.perf_counter()
+    result = {'accept': measure(client, requests, options, warm_up=0)}
+    with service.pool.connection() as conn:
+        while conn.execute("select count(*) from Import_Jobs where status in ('pending', 'running')").fetchone()[0]:
+            time.sleep(0.01)
+        completed = conn.execute("select count(*) from Import_Jobs where status = 'completed' and name like ?",
+                                 ('Async Import {} %'.format(size),)).fetchone()[0]
+    seconds = time.perf_counter() - start
+    assert completed == len(names)
+    result['seconds'] = round(seconds, 4)
+    result['shows_per_second'] = round(len(names) / seconds, 1)
+    return result
+
+# Import 'repeat' new TV shows one request at a time, then as a single batch
+def bench_import_batch(size, options, client):
+    names = ['Serial Import {} {}'.format(size, i) for i in range(options.repeat)]
+    start = time.perf_counter()
+    for name in names:
+        status, data = client.request('POST', '/tv-shows/import', {'name': name})
+        assert status == 201
+    serial = time.perf_counter() - start
+
+    names = ['Batch Import {} {}'.format(size, i) for i in range(options.repeat)]
+    start = time.perf_counter()
+    status, data = client.request('POST', '/tv-shows/import/batch', body=names)
+    batch = time.perf_counter() - start
+    assert json.loads(data)['created'] == len(names)
+
+    return {
+        'imports': options.repeat,
+        'serial_seconds': round(serial, 4),
+        'serial_shows_per_second': round(options.repeat / serial, 1),
+        'batch_seconds': round(batch, 4),
+        'batch_shows_per_second': round(options.repeat / batch, 1)
+    }
+
+# GET /tv-shows pages of up to 10,000 TV shows with a narrow and a wide filter
+def bench_list_page(size, options, client):
+    rng = random.Random(1)
+    page_size = min(10000, size)
+    pages = [rng.randrange(size // page_size) + 1 for i in range(options.repeat)]
+    result = {'page_size': page_size}
+    for name, fields in [('narrow', 'id,name'), ('wide', ','.join(service.SHOW_COLUMNS))]:
+        result[name] = measure(client, [get('/tv-shows', {'page': page, 'page_size': page_size,
+                                                          'filter': fields}) for page in pages], options)
+    return result
+
+# GET /tv-shows/search for the number of a random TV show, matching it and the TV shows whose
+# numbers start with it, and for a word in a quarter of the TV show names
+def bench_search(size, options, client):
+    rng = random.Random(1)
+    numbers = [rng.randrange(size) for i in range(options.repeat)]
+    return {
+        'selective': measure(client, [get('/tv-shows/search', {'q': number}) for number in numbers], options),
+        'broad': measure(client, [get('/tv-shows/search', {'q': 'rising', 'page': page % 10 + 1, 'page_size': 10})
+                                  for page in range(options.repeat)], options)
+    }
+
+# GET /tv-shows pages of 100 TV shows from the last tenth of the table, by offset and by cursor
+def bench_list_deep(size, options, client):
+    rng = random.Random(1)
+    page_count = size // 100
+    pages = [rng.randrange(page_count - max(1, page_count // 10), page_count) + 1 for i in range(options.repeat)]
+    result = {'page_size': 100}
+    result['offset'] = measure(client, [get('/tv-shows', {'page': page, 'page_size': 100}) for page in pages], options)
+
+    # Cursor tokens of the same pages, from the last TV show of the pages before them
+    tokens = {1: ''}
+    for page in sorted(set(pages) - {1}):
+        status, data = client.request('GET', '/tv-shows', {'page': page - 1, 'page_size': 100})
+        last = json.loads(data)['tv_shows'][-1]['id']
+        tokens[page] = service.encode_after([last], service.parse_order_by('+id'))
+    result['cursor'] = measure(client, [get('/tv-shows', {'page_size': 100, 'after': tokens[page]}) for page in pages], options)
+    return result
+
+# GET /tv-shows pages of 100 TV shows ordered by several keys
+def bench_list_order(size, options, client):
+    rng = random.Random(1)
+    page_count = size // 100
+    result = {'page_size': 100}
+    for order_by in ['-rating,+name', '+premiered,-runtime', '+name']:
+        pages = [rng.randrange(page_count) + 1 for i in range(options.repeat)]
+        result[order_by] = measure(client, [get('/tv-shows', {'page': page, 'page_size': 100, 'order_by': order_by})
+                                             for page in pages], options)
+    return result
+
+# PATCH random TV shows with a new rating and weight
+def bench_patch(size, options, client):
+    rng = random.Random(1)
+    requests = [('PATCH', '/tv-shows/' + str(rng.randrange(size)), None,
+                 {'rating': {'average': round(rng.uniform(1, 10), 1)}, 'weight': rng.randrange(100)}, 200)
+                for i in range(options.repeat)]
+    return measure(client, requests, options)
+
+# DELETE 'repeat' distinct random TV shows
+def bench_delete(size, options, client):
+    ids = random.Random(1).sample(range(size), min(options.repeat, size))
+    return measure(client, [('DELETE', '/tv-shows/' + str(id), None, None, 200) for id in ids], options, warm_up=0)
+
+# GET /tv-shows/statistics as JSON and as a chart for every attribute
+def bench_statistics(format):
+    def bench(size, options, client):
+        result = {}
+        for by in ['language', 'genres', 'status', 'type']:
+            query = {'format': format, 'by': by}
+            # The first chart of each attribute is rendered, the others come from the chart cache
+            result[by] = measure(client, [get('/tv-shows/statistics', query)] * options.repeat, options)
+        return result
+    return bench
+
+# GET /tv-shows/statistics/updates hourly over a day and daily over four weeks
+def bench_statistics_updates(size, options, client):
+    return {
+        'hourly': measure(client, [get('/tv-shows/statistics/updates', {'window': '24h'})] * options.repeat, options),
+        'daily': measure(client, [get('/tv-shows/statistics/updates', {'window': '4w', 'bucket': '1d'})]
+                         * options.repeat, options)
+    }
+
+# Compare the statistics computed from the columnar snapshot with those from the counters, and
+# reading the whole table for analysis from the snapshot with pd.read_sql_query; the snapshot is
+# built from scratch, then brought up to date after 100 TV shows are patched
+def bench_statistics_snapshot(size, options, client):
+    import snapshot
+    path = service.snapshots.file()
+    if os.path.exists(path):
+        os.unlink(path)
+    service.snapshots = service.SnapshotStore()
+    with service.pool.connection() as conn:
+        start = time.perf_counter()
+        service.snapshots.current(conn)
+        built = time.perf_counter() - start
+
+        start = time.perf_counter()
+        frame = pd.read_sql_query('select ' + ', '.join(snapshot.COLUMNS) + ' from TV_Shows', conn)
+        sql_read = time.perf_counter() - start
+        start = time.perf_counter()
+        frame = snapshot.load(path).to_frame()
+        snapshot_read = time.perf_counter() - start
+        del frame
+
+    result = {
+        'build_seconds': round(built, 4),
+        'file_mb': round(os.path.getsize(path) / 1024 / 1024, 2),
+        'sql_read_seconds': round(sql_read, 4),
+        'snapshot_read_seconds': round(snapshot_read, 4)
+    }
+    for by in ['language', 'genres']:
+        query = {'format': 'json', 'by': by}
+        result[by] = {
+            'counters': measure(client, [get('/tv-shows/statistics', query)] * options.repeat, options),
+            'snapshot': measure(client, [get('/tv-shows/statistics', dict(query, source='snapshot'))]
+                                * options.repeat, options)
+        }
+
+    rng = random.Random(1)
+    for i in range(100):
+        status, data = client.request('PATCH', '/tv-shows/' + str(rng.randrange(size)), None,
+                                      {'language': rng.choice(['English', 'Dutch'])})
+    with service.pool.connection() as conn:
+        start = time.perf_counter()
+        service.snapshots.current(conn)
+        result['update_seconds'] = round(time.perf_counter() - start, 4)
+    return result
+
+# Refresh the 'repeat' stalest TV shows from the stub tvmaze API without a rate limit
+def bench_refresh(size, options, client):
+    refresher = service.ShowRefresher(rate=None)
+    start = time.perf_counter()
+    while (refresher.checked < min(options.repeat, size)) and refresher.run_once():
+        pass
+    seconds = time.perf_counter() - start
+
+    stats = refresher.stats()
+    return {
+        'checked': stats['checked'],
+        'changed': stats['changed'],
+        'errors': stats['errors'],
+        'seconds': round(seconds, 4),
+        'shows_per_second': round(stats['checked'] / seconds, 1),
+        'queue_depth': stats['queue_depth']
+    }
+
+# Benchmarks in the order 'all' runs them on the same database: reads first, then the
+# benchmarks that change or remove TV shows
+BENCHMARKS = {
+    'startup': bench_startup,
+    'get-by-id': bench_get_by_id,
+    'multi-get': bench_multi_get,
+    'decode': bench_decode,
+    'list-page': bench_list_page,
+    'list-deep': bench_list_deep,
+    'list-order': bench_list_order,
+    'search': bench_search,
+    'statistics-json': bench_statistics('json'),
+    'statistics-image': bench_statistics('image'),
+    'statistics-updates': bench_statistics_updates,
+    'statistics-snapshot': bench_statistics_snapshot,
+    'patch': bench_patch,
+    'import': bench_import,
+    'import-async': bench_import_async,
+    'import-batch': bench_import_batch,
+    'refresh': bench_refresh,
+    'delete': bench_delete
+}
+
+# Identify the revision being benchmarked, so that results can be compared between revisions
+def revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the TV Shows API')
+    parser.add_argument('benchmark', choices=list(BENCHMARKS) + ['all'])
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma separated numbers of TV shows to seed')
+    parser.add_argument('--repeat', type=int, default=1000, help='requests per size')
+    parser.add_argument('--upstream-latency', type=float, default=0.02,
+                        help='seconds the stub tvmaze API waits before answering')
+    parser.add_argument('--server', action='store_true',
+                        help='send requests to a multi-threaded HTTP server instead of the test client')
+    parser.add_argument('--concurrency', type=int, default=1, help='threads sending requests')
+    parser.add_argument('--no-cache', action='store_true', help='disable the response and chart caches')
+    parser.add_argument('--output', help='also write the results to this file')
+    args = parser.parse_args()
+
+    if args.no_cache:
+        service.show_cache.entries.maxsize = 0
+        service.page_cache.entries.maxsize = 0
+        service.charts.cache.maxsize = 0
+    stub, url = start_stub_tvmaze(args.upstream_latency)
+    service.tvmaze = service.TvmazeClient(url)
+    server = None
+    if args.server:
+        server, client = start_server()
+    else:
+        client = TestClient()
+
+    names = list(BENCHMARKS) if (args.benchmark == 'all') else [args.benchmark]
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for size in [int(size) for size in args.sizes.split(',')]:
+                start = time.perf_counter()
+                open_database(directory, size)
+                seconds = round(time.perf_counter() - start, 2)
+                for name in names:
+                    result = {'benchmark': name, 'shows': size, 'seed_seconds': seconds}
+                    result.update(BENCHMARKS[name](size, args, client))
+                    result['peak_rss_mb'] = peak_rss_mb()
+                    results.append(result)
+    finally:
+        stub.shutdown()
+        if server is not None:
+            server.shutdown()
+
+    output = json.dumps({
+        'revision': revision(),
+        'python': platform.python_version(),
+        'mode': 'server' if args.server else 'test-client',
+        'concurrency': args.concurrency,
+        'repeat': args.repeat,
+        'upstream_latency': args.upstream_latency,
+        'cache': not args.no_cache,
+        'results': results
+    }, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
\ No newline at end of file
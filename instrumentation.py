@@ -0,0 +1,145 @@
+# Latency instrumentation for the TV Shows API
+#
+# Durations are aggregated into histograms keyed by metric name and labels and
+# rendered in the Prometheus text exposition format. Named spans time the hot
+# sections of a request; spans over SQL can be logged when they are slow.
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+slow_query_log = logging.getLogger('tv_shows.slow_query')
+
+# Thread-safe histogram counting observations per bucket
+class Histogram:
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        # Find the first bucket the value fits in, the last one being +Inf
+        low, high = 0, len(self.buckets)
+        while (low < high):
+            middle = (low + high) // 2
+            if (value <= self.buckets[middle]):
+                high = middle
+            else:
+                low = middle + 1
+        with self._lock:
+            self._counts[low] += 1
+            self._sum += value
+
+    # Return the cumulative count of each bucket, the sum and the count of observations
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        count = 0
+        for bucket_count in counts:
+            count += bucket_count
+            cumulative.append(count)
+        return cumulative, total, count
+
+# Format a Prometheus label set from (name, value) pairs
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{}="{}"'.format(name, value))
+    return '{' + ','.join(pairs) + '}'
+
+# Format a sample value the way Prometheus parses it
+def format_value(value):
+    if math.isinf(value):
+        return '+Inf' if (value > 0) else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Histograms of durations by metric name and labels, all prefixed by 'namespace'
+class Registry:
+
+    def __init__(self, namespace, buckets=DEFAULT_BUCKETS, slow_query=None):
+        self.namespace = namespace
+        self.buckets = buckets
+        # Spans over SQL ('sql.' names) taking longer than 'slow_query' seconds are logged
+        self.slow_query = slow_query
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help):
+        self._help[name] = help
+
+    # Record a duration in seconds for the metric 'name' with the given (name, value) label pairs
+    def observe(self, name, labels, value):
+        key = (name, tuple(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+        histogram.observe(value)
+
+    # Record the duration of a named section of a request
+    def record(self, span, seconds, detail=None):
+        self.observe('span_duration_seconds', (('span', span),), seconds)
+        if (self.slow_query is not None) and span.startswith('sql.') and (seconds >= self.slow_query):
+            slow_query_log.warning('%s took %.1f ms%s', span, seconds * 1000, ': ' + detail if detail else '')
+
+    # Time the enclosed block as the span 'span'; 'detail' (such as the SQL) is only logged
+    @contextmanager
+    def span(self, span, detail=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(span, time.perf_counter() - start, detail)
+
+    # Render the histograms, followed by 'gauges' given as (name, value) pairs,
+    # in the Prometheus text exposition format
+    def render(self, gauges=()):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        lines = []
+        described = set()
+        for (name, labels), histogram in histograms:
+            metric = self.namespace + '_' + name
+            if name not in described:
+                described.add(name)
+                if name in self._help:
+                    lines.append('# HELP {} {}'.format(metric, self._help[name]))
+                lines.append('# TYPE {} histogram'.format(metric))
+            cumulative, total, count = histogram.snapshot()
+            for bound, bucket_count in zip(histogram.buckets + [math.inf], cumulative):
+                bucket_labels = labels + (('le', format_value(bound)),)
+                lines.append('{}_bucket{} {}'.format(metric, format_labels(bucket_labels), bucket_count))
+            lines.append('{}_sum{} {}'.format(metric, format_labels(labels), format_value(total)))
+            lines.append('{}_count{} {}'.format(metric, format_labels(labels), count))
+        for name, value in gauges:
+            metric = self.namespace + '_' + name
+            lines.append('# TYPE {} gauge'.format(metric))
+            lines.append('{} {}'.format(metric, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+# Flatten nested dicts of statistics into (name, value) pairs of their numeric values,
+# joining the keys with underscores
+def flatten_stats(stats, prefix=''):
+    pairs = []
+    for key, value in stats.items():
+        name = prefix + str(key)
+        if isinstance(value, dict):
+            pairs += flatten_stats(value, name + '_')
+        elif isinstance(value, bool):
+            pairs.append((name, int(value)))
+        elif isinstance(value, (int, float)):
+            pairs.append((name, value))
+    return pairs
\ No newline at end of file
@@ -0,0 +1,209 @@
+# Columnar snapshot of the TV_Shows table for analytics
+#
+# A snapshot holds the columns statistics and offline analysis read: the language,
+# status, type and genres of every TV show dictionary-encoded as integer codes, and
+# its runtime, rating and weight as floats. It is stored in a single file of a JSON
+# header followed by the raw arrays, which are memory-mapped and read as numpy arrays
+# without copying. A snapshot is brought up to date by reading only the TV shows
+# Show_Changes records as changed since the table version it was taken at.
+
+import json
+import math
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+import numpy as np
+
+MAGIC = b'TVSHOWS\x02'
+
+# Arrays start on multiples of this many bytes of the file
+ALIGNMENT = 64
+
+# Columns stored as codes into a dictionary of their distinct values; a null is code -1
+DICTIONARY_COLUMNS = ['language', 'status', 'type']
+
+# Columns stored as floats; a null is NaN
+NUMERIC_COLUMNS = ['runtime', 'rating', 'weight']
+
+# Columns of TV_Shows read into a snapshot
+COLUMNS = ['id', 'last_update'] + DICTIONARY_COLUMNS + ['genres'] + NUMERIC_COLUMNS
+
+# Type of each array; the genres of row i are genre_codes[genre_offsets[i]:genre_offsets[i + 1]]
+ARRAY_TYPES = dict([('id', '<i8'), ('last_update', '<i8')]
+                   + [(column, '<i4') for column in DICTIONARY_COLUMNS]
+                   + [('genre_offsets', '<i8'), ('genre_codes', '<i4')]
+                   + [(column, '<f8') for column in NUMERIC_COLUMNS])
+
+class Snapshot:
+
+    def __init__(self, version, dictionaries, arrays, mapping=None):
+        # Version of the TV_Shows table the snapshot was taken at
+        self.version = version
+        # Distinct values of each dictionary-encoded column and of 'genres', in code order
+        self.dictionaries = dictionaries
+        self.arrays = arrays
+        # Memory map the arrays are read from, if the snapshot was loaded from a file
+        self._mapping = mapping
+
+    @property
+    def rows(self):
+        return len(self.arrays['id'])
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    # Return (value, count) for every value of 'column' ('genres' or a dictionary-encoded
+    # column) held by at least one TV show, a null value being None
+    def counts(self, column):
+        values = self.dictionaries[column]
+        codes = self.arrays['genre_codes' if (column == 'genres') else column]
+        # Shift the codes by one so that nulls are counted first
+        counts = np.bincount(codes + 1, minlength=len(values) + 1)
+        return [(values[code - 1] if code else None, int(counts[code])) for code in np.flatnonzero(counts)]
+
+    # Count the TV shows last updated after 'since' (seconds since the epoch)
+    def count_updated(self, since):
+        return int(np.count_nonzero(self.arrays['last_update'] > since))
+
+    # Return the snapshot as a pandas DataFrame indexed by id, with categorical columns for the
+    # dictionary-encoded ones; genres are left out since a TV show has several of them
+    def to_frame(self):
+        import pandas as pd
+        columns = {'last_update': pd.to_datetime(self.arrays['last_update'], unit='s')}
+        for column in DICTIONARY_COLUMNS:
+            columns[column] = pd.Categorical.from_codes(self.arrays[column], self.dictionaries[column])
+        for column in NUMERIC_COLUMNS:
+            columns[column] = self.arrays[column]
+        return pd.DataFrame(columns, index=pd.Index(self.arrays['id'], name='id'))
+
+    # Write the snapshot to 'path', replacing any previous file at once
+    def save(self, path):
+        layout = {}
+        offset = 0
+        for name, array in self.arrays.items():
+            layout[name] = {'offset': offset, 'length': len(array)}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header = json.dumps({
+            'version': self.version,
+            'dictionaries': self.dictionaries,
+            'arrays': layout
+        }).encode()
+        start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                                 prefix=os.path.basename(path) + '.')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                file.write(MAGIC + len(header).to_bytes(8, 'little') + header)
+                for name, array in self.arrays.items():
+                    file.seek(start + layout[name]['offset'])
+                    file.write(np.ascontiguousarray(array, ARRAY_TYPES[name]).tobytes())
+                file.truncate(start + offset)
+            # mkstemp creates the file readable by its owner only
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+# Load the snapshot stored in 'path'; its arrays are read-only views of the memory-mapped file.
+# Raises ValueError if the file is not a snapshot
+def load(path):
+    with open(path, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    if (mapping[:len(MAGIC)] != MAGIC):
+        mapping.close()
+        raise ValueError("'{}' is not a TV shows snapshot".format(path))
+    length = int.from_bytes(mapping[len(MAGIC):len(MAGIC) + 8], 'little')
+    header = json.loads(mapping[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+    start = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+    arrays = {}
+    for name, array_type in ARRAY_TYPES.items():
+        layout = header['arrays'][name]
+        arrays[name] = np.frombuffer(mapping, array_type, layout['length'], start + layout['offset'])
+    return Snapshot(header['version'], header['dictionaries'], arrays, mapping)
+
+# Encode rows of COLUMNS into arrays, adding the values missing from 'dictionaries' to them
+def encode(rows, dictionaries):
+    codes = {column: {value: code for code, value in enumerate(values)}
+             for column, values in dictionaries.items()}
+
+    def encode_value(column, value):
+        if value is None:
+            return -1
+        code = codes[column].get(value)
+        if code is None:
+            code = codes[column][value] = len(dictionaries[column])
+            dictionaries[column].append(value)
+        return code
+
+    columns = {name: [] for name in ARRAY_TYPES}
+    columns['genre_offsets'].append(0)
+    for row in rows:
+        columns['id'].append(row[0])
+        columns['last_update'].append(row[1])
+        for index, column in enumerate(DICTIONARY_COLUMNS, 2):
+            columns[column].append(encode_value(column, row[index]))
+        # A genre listed twice for a TV show is only counted once, as by the statistics counters
+        genres = set(json.loads(row[5]) or []) if row[5] else ()
+        columns['genre_codes'] += [encode_value('genres', genre) for genre in genres]
+        columns['genre_offsets'].append(len(columns['genre_codes']))
+        for index, column in enumerate(NUMERIC_COLUMNS, 6):
+            value = row[index]
+            columns[column].append(float(value) if isinstance(value, (int, float)) else math.nan)
+    return {name: np.array(values, ARRAY_TYPES[name]) for name, values in columns.items()}
+
+# Select the lists of the given rows from lists stored as offsets into their values,
+# returning the offsets and values of the selection
+def take_lists(offsets, values, rows):
+    starts = offsets[:-1][rows]
+    lengths = offsets[1:][rows] - starts
+    taken = np.zeros(len(rows) + 1, ARRAY_TYPES['genre_offsets'])
+    np.cumsum(lengths, out=taken[1:])
+    index = np.repeat(starts - taken[:-1], lengths) + np.arange(taken[-1])
+    return taken, values[index]
+
+# Read from 'conn' in one transaction, so that the version of the TV_Shows table and
+# the rows read are consistent
+@contextmanager
+def read_transaction(conn):
+    conn.execute('begin')
+    try:
+        yield conn.execute("select version from Table_Versions where name = 'TV_Shows'").fetchone()[0]
+    finally:
+        conn.execute('commit')
+
+# Take a snapshot of the whole TV_Shows table
+def build(conn):
+    dictionaries = {column: [] for column in DICTIONARY_COLUMNS + ['genres']}
+    with read_transaction(conn) as version:
+        arrays = encode(conn.execute('select ' + ', '.join(COLUMNS) + ' from TV_Shows'), dictionaries)
+    return Snapshot(version, dictionaries, arrays)
+
+# Bring 'snapshot' up to date with the TV_Shows table: the TV shows changed since its version
+# replace their previous values, and deleted ones are dropped. The table version is incremented
+# in the same transaction as each change, so the changes are read exactly, whatever their
+# 'last_update'. Codes of existing values are kept, so the dictionaries only grow; a new
+# snapshot is built when it is not in use
+def update(snapshot, conn):
+    with read_transaction(conn) as version:
+        if (version <= snapshot.version):
+            return snapshot
+        # Deleted TV shows are the changed ids without a row
+        changes = conn.execute('select Show_Changes.id, ' + ', '.join('TV_Shows.' + column for column in COLUMNS)
+                               + ' from Show_Changes left join TV_Shows on TV_Shows.id = Show_Changes.id\
+                                  where Show_Changes.version > ?', (snapshot.version,)).fetchall()
+    dictionaries = {column: list(values) for column, values in snapshot.dictionaries.items()}
+    changed = encode((change[1:] for change in changes if change[1] is not None), dictionaries)
+    old = snapshot.arrays
+    kept = np.flatnonzero(~np.isin(old['id'], np.array([change[0] for change in changes], ARRAY_TYPES['id'])))
+
+    arrays = {}
+    for name in ARRAY_TYPES:
+        if name not in ['genre_offsets', 'genre_codes']:
+            arrays[name] = np.concatenate([old[name][kept], changed[name]])
+    offsets, codes = take_lists(old['genre_offsets'], old['genre_codes'], kept)
+    arrays['genre_offsets'] = np.concatenate([offsets, changed['genre_offsets'][1:] + offsets[-1]])
+    arrays['genre_codes'] = np.concatenate([codes, changed['genre_codes']])
+    return Snapshot(version, dictionaries, arrays)
\ No newline at end of file
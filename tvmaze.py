@@ -0,0 +1,234 @@
+# Client for the external tvmaze API
+#
+# Requests go through a pluggable transport (by default persistent keep-alive
+# HTTP connections), time out, are retried with exponential backoff on
+# transient failures, and search results are kept in a bounded LRU cache with
+# a time to live. Bulk callers can pace their requests with a token bucket.
+
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+TVMAZE_URL = 'http://api.tvmaze.com'
+
+# Raised when the tvmaze API cannot be reached or answers with an error
+class UpstreamError(Exception):
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+# Transport keeping one keep-alive connection per host for each thread
+class HTTPTransport:
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connections(self):
+        if not hasattr(self._local, 'connections'):
+            self._local.connections = {}
+        return self._local.connections
+
+    # Send a GET request and return the response status and body
+    def request(self, url):
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        connections = self._connections()
+        conn = connections.get(key)
+        if conn is None:
+            if (parts.scheme == 'https'):
+                conn = http.client.HTTPSConnection(parts.netloc, timeout=self.timeout)
+            else:
+                conn = http.client.HTTPConnection(parts.netloc, timeout=self.timeout)
+            connections[key] = conn
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        try:
+            conn.request('GET', path, headers={'Accept': 'application/json'})
+            response = conn.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            # Drop the broken connection so the next attempt reconnects
+            conn.close()
+            del connections[key]
+            raise
+        return response.status, body
+
+    # Close the connections opened by the calling thread
+    def close(self):
+        connections = self._connections()
+        for conn in connections.values():
+            conn.close()
+        connections.clear()
+
+# Thread-safe LRU cache whose entries expire 'ttl' seconds after being stored
+class TTLCache:
+
+    def __init__(self, maxsize=1024, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # Return the cached value for 'key' or None if it is missing or expired
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if (expires > self.clock()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            # Evict the least recently used entries
+            while (len(self._entries) > self.maxsize):
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+# Thread-safe token bucket allowing 'rate' calls per second on average and bursts of
+# up to 'burst' calls; a rate of None disables the limit
+class TokenBucket:
+
+    def __init__(self, rate, burst=1, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_time = 0.0
+
+    # Block until a call is allowed
+    def acquire(self):
+        if self.rate is None:
+            return
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Take the token now, waiting for it outside the lock if the bucket is empty
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if (self._tokens < 0) else 0
+            if wait:
+                self.waits += 1
+                self.wait_time += wait
+        if wait:
+            self.sleep(wait)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 6)
+            }
+
+# Normalise a search query so that case and spacing do not create new cache entries
+def normalise_query(query):
+    return ' '.join(query.lower().split())
+
+class TvmazeClient:
+
+    def __init__(self, base_url=TVMAZE_URL, transport=None, retries=3, backoff=0.25,
+                 cache_size=1024, cache_ttl=300.0):
+        self.base_url = base_url.rstrip('/')
+        self.transport = transport if transport is not None else HTTPTransport()
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retried = 0
+        self.errors = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    # Fetch and decode a JSON resource, retrying connection errors, 429 and 5xx responses
+    def get(self, path, params=None):
+        url = self.base_url + path
+        if params:
+            url += '?' + urllib.parse.urlencode(params, quote_via=urllib.parse.quote)
+        attempt = 0
+        while True:
+            self._count('requests')
+            try:
+                status, body = self.transport.request(url)
+                if (status == 200):
+                    try:
+                        return json.loads(body)
+                    except ValueError:
+                        self._count('errors')
+                        raise UpstreamError('tvmaze returned an invalid JSON body', status)
+                error = UpstreamError('tvmaze responded with status {}'.format(status), status)
+                retry = (status == 429 or status >= 500)
+            except (OSError, http.client.HTTPException) as exception:
+                error = UpstreamError('tvmaze request failed: {}'.format(exception))
+                retry = True
+            if not retry or (attempt >= self.retries):
+                self._count('errors')
+                raise error
+            # Exponential backoff with jitter
+            time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+            attempt += 1
+            self._count('retried')
+
+    # Search TV shows by name; results are shared between callers and must not be modified
+    def search_shows(self, name):
+        query = normalise_query(name)
+        results = self.cache.get(query)
+        if results is None:
+            results = self.get('/search/shows', {'q': query})
+            self.cache.set(query, results)
+        return results
+
+    # Get a TV show by its tvmaze id; not cached, so the current version is returned
+    def get_show(self, tvmaze_id):
+        return self.get('/shows/' + str(int(tvmaze_id)))
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'requests': self.requests,
+                'retried': self.retried,
+                'errors': self.errors
+            }
+        stats['cache'] = self.cache.stats()
+        return stats
\ No newline at end of file
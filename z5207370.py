@@ -1,18 +1,637 @@
-import pandas as pd
-from flask import Flask, request, send_file
+import click
+from flask import Flask, Response, g, request
 from flask_restx import Resource, Api, fields, reqparse
 import sqlite3
-import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
-import matplotlib.pyplot as plt
+import base64
+import cProfile
+import hashlib
+import hmac
+import argparse
+import csv
+import io
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+from itertools import groupby
+from contextlib import contextmanager
+from tvmaze import TVMAZE_URL, TokenBucket, TTLCache, TvmazeClient, UpstreamError
+from instrumentation import Registry, flatten_stats
 
-app = Flask(__name__)
-api = Api(app,
-          default="TV Shows",  # Default namespace
+# Database settings
+DATABASE = os.environ.get('TV_SHOWS_DATABASE', 'z5207370.db')
+POOL_SIZE = int(os.environ.get('TV_SHOWS_POOL_SIZE', 8))
+POOL_TIMEOUT = float(os.environ.get('TV_SHOWS_POOL_TIMEOUT', 30))
+
+# Batch import settings
+BATCH_IMPORT_LIMIT = int(os.environ.get('TV_SHOWS_BATCH_IMPORT_LIMIT', 5000))
+BATCH_IMPORT_WORKERS = int(os.environ.get('TV_SHOWS_BATCH_IMPORT_WORKERS', 16))
+
+# Asynchronous import settings; finished jobs are kept for 'ttl' seconds
+IMPORT_WORKERS = int(os.environ.get('TV_SHOWS_IMPORT_WORKERS', 4))
+IMPORT_JOB_TTL = float(os.environ.get('TV_SHOWS_IMPORT_JOB_TTL', 24 * 60 * 60))
+
+# Batch update settings
+BATCH_UPDATE_LIMIT = int(os.environ.get('TV_SHOWS_BATCH_UPDATE_LIMIT', 5000))
+
+# Most TV shows a single GET /tv-shows?ids=... can read
+MULTI_GET_LIMIT = int(os.environ.get('TV_SHOWS_MULTI_GET_LIMIT', 5000))
+
+# Statistics chart settings
+CHART_CACHE_SIZE = int(os.environ.get('TV_SHOWS_CHART_CACHE_SIZE', 64))
+CHART_CACHE_TTL = float(os.environ.get('TV_SHOWS_CHART_CACHE_TTL', 3600))
+
+# Columnar snapshot file; by default it is kept next to the database as '<database>.snapshot'
+SNAPSHOT_PATH = os.environ.get('TV_SHOWS_SNAPSHOT')
+
+# Response cache settings
+SHOW_CACHE_SIZE = int(os.environ.get('TV_SHOWS_SHOW_CACHE_SIZE', 4096))
+PAGE_CACHE_SIZE = int(os.environ.get('TV_SHOWS_PAGE_CACHE_SIZE', 64))
+PAGE_CACHE_MAX_BODY = int(os.environ.get('TV_SHOWS_PAGE_CACHE_MAX_BODY', 1024 * 1024))
+RESPONSE_CACHE_TTL = float(os.environ.get('TV_SHOWS_RESPONSE_CACHE_TTL', 3600))
+
+# Background refresh settings; each TV show is checked against tvmaze about once every
+# 'interval' seconds, at most 'rate' requests per second (tvmaze allows 20 every 10 seconds)
+REFRESH_ENABLED = os.environ.get('TV_SHOWS_REFRESH', '0') == '1'
+REFRESH_INTERVAL = float(os.environ.get('TV_SHOWS_REFRESH_INTERVAL', 24 * 60 * 60))
+REFRESH_BATCH_SIZE = int(os.environ.get('TV_SHOWS_REFRESH_BATCH_SIZE', 50))
+REFRESH_WORKERS = int(os.environ.get('TV_SHOWS_REFRESH_WORKERS', 4))
+REFRESH_RATE = float(os.environ.get('TV_SHOWS_REFRESH_RATE', 2))
+REFRESH_IDLE = float(os.environ.get('TV_SHOWS_REFRESH_IDLE', 60))
+
+# Serving settings: 'workers' processes of 'threads' threads each
+SERVE_BIND = os.environ.get('TV_SHOWS_BIND', '127.0.0.1:5000')
+SERVE_WORKERS = int(os.environ.get('TV_SHOWS_WORKERS', 2))
+SERVE_THREADS = int(os.environ.get('TV_SHOWS_THREADS', 8))
+
+# Instrumentation settings: SQL slower than TV_SHOWS_SLOW_QUERY_MS milliseconds is logged,
+# and requests whose 'X-Profile' header is TV_SHOWS_PROFILE_TOKEN are profiled with cProfile
+# into TV_SHOWS_PROFILE_DIR; both are off unless set
+SLOW_QUERY_MS = os.environ.get('TV_SHOWS_SLOW_QUERY_MS')
+PROFILE_TOKEN = os.environ.get('TV_SHOWS_PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('TV_SHOWS_PROFILE_DIR', 'profiles')
+
+# Latency histograms of requests and of the named spans within them
+registry = Registry('tv_shows', slow_query=float(SLOW_QUERY_MS) / 1000 if SLOW_QUERY_MS else None)
+registry.describe('request_duration_seconds', 'Time to serve a request, including streaming its body')
+registry.describe('span_duration_seconds', 'Time spent in a named section of a request')
+span = registry.span
+
+# Client for the tvmaze API, shared so that connections and cached searches are reused
+tvmaze = TvmazeClient(os.environ.get('TVMAZE_URL', TVMAZE_URL))
+
+# Pool of long-lived SQLite connections shared by the threads of one process
+class ConnectionPool:
+
+    def __init__(self, database, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self._reset()
+
+    def _reset(self):
+        # Connections must never be shared with a forked child, so each process starts its own pool
+        self._pid = os.getpid()
+        self._condition = threading.Condition(threading.Lock())
+        self._idle = []
+        self._created = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def _connect(self):
+        # Autocommit mode: transactions are opened explicitly with transaction()
+        conn = sqlite3.connect(self.database, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=256)
+        conn.execute('pragma journal_mode = wal')
+        conn.execute('pragma synchronous = normal')
+        conn.execute('pragma cache_size = -16000')
+        conn.execute('pragma mmap_size = 268435456')
+        conn.execute('pragma temp_store = memory')
+        conn.execute('pragma busy_timeout = ' + str(int(self.timeout * 1000)))
+        return conn
+
+    def acquire(self):
+        if (self._pid != os.getpid()):
+            self._reset()
+        with self._condition:
+            # Reuse the most recently released connection if one is idle
+            if self._idle:
+                self.hits += 1
+                return self._idle.pop()
+            # Otherwise open a new one while below the pool size
+            if (self._created < self.size):
+                self._created += 1
+                self.misses += 1
+            # Otherwise wait for another thread to release a connection
+            else:
+                self.waits += 1
+                start = time.perf_counter()
+                deadline = start + self.timeout
+                while not self._idle:
+                    remaining = deadline - time.perf_counter()
+                    if (remaining <= 0):
+                        self.wait_time += time.perf_counter() - start
+                        raise TimeoutError('Timed out waiting for a database connection')
+                    self._condition.wait(remaining)
+                self.wait_time += time.perf_counter() - start
+                return self._idle.pop()
+        try:
+            return self._connect()
+        except Exception:
+            with self._condition:
+                self._created -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, conn):
+        # Connections opened before a fork belong to the parent process
+        if (self._pid != os.getpid()):
+            return
+        # Never hand out a connection with a transaction left open
+        if conn.in_transaction:
+            conn.rollback()
+        with self._condition:
+            self._idle.append(conn)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    # Close the idle connections, such as before forking worker processes
+    def close(self):
+        if (self._pid != os.getpid()):
+            return
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._condition:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'idle': len(self._idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'wait_time': round(self.wait_time, 6)
+            }
+
+pool = ConnectionPool(DATABASE)
+
+# Run the enclosed statements in a single write transaction
+@contextmanager
+def transaction(conn):
+    conn.execute('begin immediate')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+# Normalise a TV show name so that spacing, hyphens and case do not matter
+def normalise_name(name):
+    return name.replace(' ', '_').replace('-', '_').lower()
+
+# Add the normalised name column used for duplicate detection
+def migrate_name_key(conn):
+    conn.create_function('normalise_name', 1, normalise_name, deterministic=True)
+    conn.execute('alter table TV_Shows add column name_key varchar(255)')
+    conn.execute('update TV_Shows set name_key = normalise_name(name)')
+    conn.execute('create unique index TV_Shows_name_key on TV_Shows (name_key)')
+
+# Add the table of sequences used to allocate ids
+def migrate_sequences(conn):
+    conn.execute('create table Sequences (\
+                      name varchar(255) primary key,\
+                      value integer not null)')
+    # The first TV show gets id 0, as it did when ids were allocated with max(id) + 1
+    conn.execute("insert into Sequences (name, value)\
+                      select 'TV_Shows', coalesce(max(id), -1) from TV_Shows")
+
+# Add the indexes used to sort and seek TV shows by each 'order_by' field
+def migrate_order_indexes(conn):
+    for field in ['name', 'runtime', 'premiered', 'rating']:
+        conn.execute('create index TV_Shows_{0} on TV_Shows ({0}, id)'.format(field))
+
+# Attributes TV show statistics are broken down by, besides genres
+STATISTICS_DIMENSIONS = ['language', 'status', 'type']
+
+# SQL statements adding 'delta' to the counter of 'value' (an SQL expression) in 'dimension'
+def statistics_counter_sql(dimension, value, delta):
+    return "insert into Show_Statistics (dimension, value, count)\
+                select '{0}', {1}, 0\
+                where not exists (select 1 from Show_Statistics where dimension = '{0}' and value is {1});\
+            update Show_Statistics set count = count + {2}\
+                where dimension = '{0}' and value is {1};".format(dimension, value, delta)
+
+# SQL statements adding 'delta' to the counter of every genre in 'genres' (a JSON list column)
+def genre_counter_sql(genres, delta):
+    return "insert into Show_Statistics (dimension, value, count)\
+                select distinct 'genres', genre.value, 0 from json_each({0}) as genre\
+                where not exists (select 1 from Show_Statistics\
+                                  where dimension = 'genres' and value = genre.value);\
+            update Show_Statistics set count = count + {1} * (select count(*) from json_each({0}) as genre\
+                                                              where genre.value = Show_Statistics.value)\
+                where dimension = 'genres' and value in (select value from json_each({0}));".format(genres, delta)
+
+# SQL statements adding 'delta' to every counter of the TV show 'row' ('new' or 'old'),
+# including its genres when they are counted from the JSON 'genres' column
+def show_counters_sql(row, delta, genres):
+    sql = statistics_counter_sql('total', 'null', delta)
+    for dimension in STATISTICS_DIMENSIONS:
+        sql += statistics_counter_sql(dimension, row + '.' + dimension, delta)
+    if genres:
+        sql += genre_counter_sql(row + '.genres', delta)
+    return sql
+
+# Create the triggers keeping the statistics counters up to date with TV_Shows
+def create_statistics_triggers(conn, genres):
+    columns = STATISTICS_DIMENSIONS + (['genres'] if genres else [])
+    conn.execute('create trigger TV_Shows_statistics_insert after insert on TV_Shows begin '
+                 + show_counters_sql('new', 1, genres) + ' end')
+    conn.execute('create trigger TV_Shows_statistics_delete after delete on TV_Shows begin '
+                 + show_counters_sql('old', -1, genres)
+                 + ' delete from Show_Statistics where count = 0; end')
+    conn.execute('create trigger TV_Shows_statistics_update after update of '
+                 + ', '.join(columns) + ' on TV_Shows begin '
+                 + show_counters_sql('old', -1, genres) + show_counters_sql('new', 1, genres)
+                 + ' delete from Show_Statistics where count = 0; end')
+
+# Add the statistics counters, kept up to date by triggers in the same transaction
+# as every insert, update and delete of a TV show
+def migrate_statistics(conn):
+    conn.execute('create table Show_Statistics (\
+                      dimension varchar(255) not null,\
+                      value varchar(255),\
+                      count integer not null)')
+    conn.execute('create index Show_Statistics_value on Show_Statistics (dimension, value)')
+    create_statistics_triggers(conn, genres=True)
+    rebuild_statistics(conn)
+
+# SQL statement adding the genres of the TV show 'row' ('new' or 'old') to Show_Genres
+def show_genres_sql(row):
+    return "insert or ignore into Show_Genres (show_id, genre)\
+                select {0}.id, genre.value from json_each({0}.genres) as genre\
+                where genre.type = 'text';".format(row)
+
+# Add the Show_Genres table indexing the TV shows of each genre; the JSON 'genres' column
+# is kept and triggers write both in the same transaction on import, patch and delete
+def migrate_show_genres(conn):
+    conn.execute('create table Show_Genres (\
+                      show_id integer not null,\
+                      genre varchar(255) not null,\
+                      primary key (show_id, genre)) without rowid')
+    conn.execute('create index Show_Genres_genre on Show_Genres (genre, show_id)')
+    conn.execute('insert or ignore into Show_Genres (show_id, genre)\
+                      select TV_Shows.id, genre.value from TV_Shows, json_each(TV_Shows.genres) as genre\
+                      where genre.type = \'text\'')
+    conn.execute('create trigger TV_Shows_genres_insert after insert on TV_Shows begin '
+                 + show_genres_sql('new') + ' end')
+    conn.execute('create trigger TV_Shows_genres_update after update of genres on TV_Shows begin\
+                      delete from Show_Genres where show_id = old.id; '
+                 + show_genres_sql('new') + ' end')
+    conn.execute('create trigger TV_Shows_genres_delete after delete on TV_Shows begin\
+                      delete from Show_Genres where show_id = old.id; end')
+
+    # Count genres from Show_Genres from now on
+    for trigger in ['insert', 'delete', 'update']:
+        conn.execute('drop trigger TV_Shows_statistics_' + trigger)
+    create_statistics_triggers(conn, genres=False)
+    conn.execute('create trigger Show_Genres_statistics_insert after insert on Show_Genres begin '
+                 + statistics_counter_sql('genres', 'new.genre', 1) + ' end')
+    conn.execute('create trigger Show_Genres_statistics_delete after delete on Show_Genres begin '
+                 + statistics_counter_sql('genres', 'old.genre', -1)
+                 + ' delete from Show_Statistics where count = 0; end')
+    rebuild_statistics(conn)
+
+# Add the TV_Shows table version, incremented by triggers in the same transaction as every
+# change to a TV show so that cached responses can be checked against it
+def migrate_table_versions(conn):
+    conn.execute('create table Table_Versions (\
+                      name varchar(255) primary key,\
+                      version integer not null) without rowid')
+    conn.execute("insert into Table_Versions (name, version) values ('TV_Shows', 0)")
+    for event in ['insert', 'update', 'delete']:
+        conn.execute('create trigger TV_Shows_version_' + event + ' after ' + event + ' on TV_Shows begin\
+                          update Table_Versions set version = version + 1 where name = \'TV_Shows\'; end')
+
+# Add the state of the background refresh, so that an interrupted refresh cycle resumes
+# from the last TV show it checked, and the index it walks TV shows from the stalest with
+def migrate_refresh_state(conn):
+    conn.execute('create table Refresh_State (\
+                      name varchar(255) primary key,\
+                      cycle_start varchar(255),\
+                      finished varchar(255),\
+                      last_update varchar(255),\
+                      id integer) without rowid')
+    conn.execute("insert into Refresh_State (name) values ('TV_Shows')")
+    conn.execute('create index TV_Shows_last_update on TV_Shows (last_update, id)')
+
+# Add the jobs of asynchronous imports; at most one job per TV show name is pending or running,
+# which coalesces identical imports
+def migrate_import_jobs(conn):
+    conn.execute('create table Import_Jobs (\
+                      id integer primary key,\
+                      name varchar(255) not null,\
+                      name_key varchar(255) not null,\
+                      status varchar(255) not null,\
+                      created datetime not null,\
+                      updated datetime not null,\
+                      result_status integer,\
+                      result text)')
+    conn.execute("create unique index Import_Jobs_active on Import_Jobs (name_key)\
+                      where status in ('pending', 'running')")
+    conn.execute("create index Import_Jobs_finished on Import_Jobs (updated)\
+                      where status in ('completed', 'failed')")
+
+# Add the full-text index of TV show names and summaries, an FTS5 table reading its content
+# from TV_Shows and kept in step with it by triggers; prefixes of 2 and 3 characters are
+# indexed too, and matches are ranked by bm25 with a match in the name worth 10 in the summary
+def migrate_show_search(conn):
+    conn.execute("create virtual table Show_Search using fts5(name, summary, content = 'TV_Shows',\
+                      tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')")
+    conn.execute("insert into Show_Search (Show_Search, rank) values ('rank', 'bm25(10.0, 1.0)')")
+    conn.execute("insert into Show_Search (Show_Search) values ('rebuild')")
+    conn.execute('create trigger TV_Shows_search_insert after insert on TV_Shows begin\
+                      insert into Show_Search (rowid, name, summary) values (new.rowid, new.name, new.summary); end')
+    conn.execute("create trigger TV_Shows_search_update after update of name, summary on TV_Shows begin\
+                      insert into Show_Search (Show_Search, rowid, name, summary)\
+                          values ('delete', old.rowid, old.name, old.summary);\
+                      insert into Show_Search (rowid, name, summary) values (new.rowid, new.name, new.summary); end")
+    conn.execute("create trigger TV_Shows_search_delete after delete on TV_Shows begin\
+                      insert into Show_Search (Show_Search, rowid, name, summary)\
+                          values ('delete', old.rowid, old.name, old.summary); end")
+
+# SQL statements adding 'delta' to the number of TV shows last updated in the hour of 'row'
+def update_hours_sql(row, delta):
+    return "insert into Update_Hours (hour, count)\
+                select {0}.last_update / 3600, 0\
+                where not exists (select 1 from Update_Hours where hour = {0}.last_update / 3600);\
+            update Update_Hours set count = count + {1} where hour = {0}.last_update / 3600;".format(row, delta)
+
+# Store 'last_update' and the refresh state as seconds since the epoch, which compare and sort
+# as integers, and add the Update_Hours counters of the TV shows by the hour of their last
+# update, kept up to date by triggers
+def migrate_update_times(conn):
+    conn.execute("update TV_Shows set last_update = cast(strftime('%s', last_update, 'utc') as integer)")
+    conn.execute('create table Refresh_State_Times (\
+                      name varchar(255) primary key,\
+                      cycle_start integer,\
+                      finished integer,\
+                      last_update integer,\
+                      id integer) without rowid')
+    conn.execute("insert into Refresh_State_Times (name, cycle_start, finished, last_update, id)\
+                      select name, cast(strftime('%s', cycle_start, 'utc') as integer),\
+                             cast(strftime('%s', finished, 'utc') as integer),\
+                             cast(strftime('%s', last_update, 'utc') as integer), id\
+                      from Refresh_State")
+    conn.execute('drop table Refresh_State')
+    conn.execute('alter table Refresh_State_Times rename to Refresh_State')
+
+    conn.execute('create table Update_Hours (\
+                      hour integer primary key,\
+                      count integer not null)')
+    conn.execute('insert into Update_Hours (hour, count)\
+                      select last_update / 3600, count(*) from TV_Shows group by last_update / 3600')
+    conn.execute('create trigger TV_Shows_updates_insert after insert on TV_Shows begin '
+                 + update_hours_sql('new', 1) + ' end')
+    conn.execute('create trigger TV_Shows_updates_delete after delete on TV_Shows begin '
+                 + update_hours_sql('old', -1) + ' delete from Update_Hours where count = 0; end')
+    conn.execute('create trigger TV_Shows_updates_update after update of last_update on TV_Shows begin '
+                 + update_hours_sql('old', -1) + update_hours_sql('new', 1)
+                 + ' delete from Update_Hours where count = 0; end')
+
+# SQL statement recording in Show_Changes that the TV show of id '{row}.id' changed at
+# the current table version
+def show_change_sql(row, condition='1'):
+    return "insert or replace into Show_Changes (id, version)\
+                select {0}.id, version from Table_Versions where name = 'TV_Shows' and {1};".format(row, condition)
+
+# Add Show_Changes, the table version each TV show id last changed at, including deletions,
+# so that copies of the table can be brought up to date from the ids changed since their
+# version; the version triggers record the changes along with incrementing the version
+def migrate_show_changes(conn):
+    conn.execute('create table Show_Changes (\
+                      id integer primary key,\
+                      version integer not null)')
+    conn.execute("insert into Show_Changes (id, version)\
+                      select id, (select version from Table_Versions where name = 'TV_Shows') from TV_Shows")
+    conn.execute('create index Show_Changes_version on Show_Changes (version)')
+    changes = {
+        'insert': show_change_sql('new'),
+        'update': show_change_sql('new') + show_change_sql('old', 'old.id != new.id'),
+        'delete': show_change_sql('old')
+    }
+    for event in ['insert', 'update', 'delete']:
+        conn.execute('drop trigger TV_Shows_version_' + event)
+        conn.execute('create trigger TV_Shows_version_' + event + ' after ' + event + ' on TV_Shows begin\
+                          update Table_Versions set version = version + 1 where name = \'TV_Shows\'; '
+                     + changes[event] + ' end')
+
+# Schema migrations in the order they are applied; 'pragma user_version'
+# records how many of them the database has already been through
+MIGRATIONS = [
+    migrate_name_key,
+    migrate_sequences,
+    migrate_order_indexes,
+    migrate_statistics,
+    migrate_show_genres,
+    migrate_table_versions,
+    migrate_refresh_state,
+    migrate_import_jobs,
+    migrate_show_search,
+    migrate_update_times,
+    migrate_show_changes
+]
+
+# Create the database tables and bring them up to the latest schema version
+def init_db(conn):
+    with transaction(conn):
+        create_schema(conn)
+        version = conn.execute('pragma user_version').fetchone()[0]
+        for migration in MIGRATIONS[version:]:
+            migration(conn)
+        conn.execute('pragma user_version = ' + str(len(MIGRATIONS)))
+
+# Get the current version of the TV_Shows table
+def table_version(conn):
+    return conn.execute("select version from Table_Versions where name = 'TV_Shows'").fetchone()[0]
+
+# Format a stored 'last_update', in seconds since the epoch, as the local time the API returns
+def format_update(last_update):
+    return datetime.fromtimestamp(last_update).strftime('%Y-%m-%d %H:%M:%S')
+
+# Seconds in each unit a time window can be given in
+TIME_UNITS = {'m': 60, 'h': 60 * 60, 'd': 24 * 60 * 60, 'w': 7 * 24 * 60 * 60}
+
+# Parse a time window such as '90m', '24h', '7d' or '2w' into seconds
+def parse_window(window):
+    match = re.fullmatch(r'([0-9]+)([mhdw])', window)
+    if (match is None) or (int(match.group(1)) == 0):
+        raise ValueError(window)
+    return int(match.group(1)) * TIME_UNITS[match.group(2)]
+
+# Count the TV shows last updated after 'since' (seconds since the epoch): the whole hours from
+# the Update_Hours counters, and the part of an hour before them from the 'last_update' index
+def count_updated(conn, since):
+    first_hour = since // 3600 + 1
+    partial = conn.execute('select count(*) from TV_Shows where last_update > ? and last_update < ?',
+                           (since, first_hour * 3600)).fetchone()[0]
+    hours = conn.execute('select coalesce(sum(count), 0) from Update_Hours where hour >= ?',
+                         (first_hour,)).fetchone()[0]
+    return partial + hours
+
+# Largest integer SQLite can store; larger Python ints cannot be bound to a query
+MAX_INTEGER = 2 ** 63 - 1
+
+# Check that 'id' fits a stored id; other ids cannot belong to any row
+def valid_id(id):
+    return 0 <= id <= MAX_INTEGER
+
+# Most values bound to the 'in' list of one statement of select_in()
+SELECT_IN_CHUNK_SIZE = 500
+
+# Run 'sql', ending with 'in', for the list of 'values' bound in chunks of SELECT_IN_CHUNK_SIZE,
+# since SQLite limits the parameters of a statement, and yield the rows of all the chunks
+def select_in(conn, sql, values):
+    values = list(values)
+    for start in range(0, len(values), SELECT_IN_CHUNK_SIZE):
+        chunk = values[start:start + SELECT_IN_CHUNK_SIZE]
+        yield from conn.execute(sql + ' (' + ', '.join('?' * len(chunk)) + ')', chunk)
+
+# Allocate the next 'count' values of a sequence; must be called inside a transaction
+def allocate_ids(conn, name, count=1):
+    conn.execute('update Sequences set value = value + ? where name = ?', (count, name))
+    last = conn.execute('select value from Sequences where name = ?', (name,)).fetchone()[0]
+    return range(last - count + 1, last + 1)
+
+# Count TV shows by every statistics attribute straight from the TV_Shows table
+def compute_statistics(conn):
+    counts = {dimension: Counter() for dimension in ['total'] + STATISTICS_DIMENSIONS + ['genres']}
+    shows = conn.execute('select ' + ', '.join(STATISTICS_DIMENSIONS) + ', genres from TV_Shows')
+    for show in shows:
+        counts['total'][None] += 1
+        for dimension, value in zip(STATISTICS_DIMENSIONS, show):
+            counts[dimension][value] += 1
+        # A genre listed twice for a TV show is only counted once
+        for genre in set(decode_json(show[-1]) or []):
+            counts['genres'][genre] += 1
+    return counts
+
+# Read the statistics counters
+def read_statistics(conn):
+    counts = {dimension: Counter() for dimension in ['total'] + STATISTICS_DIMENSIONS + ['genres']}
+    for dimension, value, count in conn.execute('select dimension, value, count from Show_Statistics\
+                                                     where count != 0'):
+        counts.setdefault(dimension, Counter())[value] += count
+    return counts
+
+# Replace the statistics counters with counts computed from the TV_Shows table;
+# must be called inside a transaction
+def rebuild_statistics(conn):
+    conn.execute('delete from Show_Statistics')
+    conn.executemany('insert into Show_Statistics (dimension, value, count) values (?, ?, ?)',
+                     [(dimension, value, count) for dimension, values in compute_statistics(conn).items()
+                                                for value, count in values.items()])
+
+# Compare the statistics counters with counts computed from the TV_Shows table and
+# return a list of (dimension, value, counter, actual) for every mismatch
+def check_statistics(conn):
+    actual = compute_statistics(conn)
+    counters = read_statistics(conn)
+    mismatches = []
+    for dimension in sorted(set(actual) | set(counters)):
+        values = set(actual.get(dimension, {})) | set(counters.get(dimension, {}))
+        for value in sorted(values, key=lambda value: (value is not None, str(value))):
+            counter = counters.get(dimension, Counter())[value]
+            count = actual.get(dimension, Counter())[value]
+            if (counter != count):
+                mismatches.append((dimension, value, counter, count))
+    return mismatches
+
+# Create the original TV_Shows table if it does not exist yet
+def create_schema(conn):
+    conn.execute('create table if not exists TV_Shows (\
+                   tvmaze_id integer not null check (tvmaze_id >= 0),\
+                   id integer not null unique check (id >= 0),\
+                   last_update datetime not null,\
+                   name varchar(255) not null,\
+                   type varchar(255),\
+                   language varchar(255),\
+                   genres varchar(255),\
+                   status varchar(255),\
+                   runtime integer,\
+                   premiered varchar(255),\
+                   officialSite varchar(255),\
+                   schedule varchar(255),\
+                   rating integer,\
+                   weight integer,\
+                   network varchar(1000),\
+                   summary varchar(1000))')
+
+# Create or migrate the database schema; safe to run again and from several processes at once
+def init_database():
+    with pool.connection() as conn:
+        init_db(conn)
+
+# The resources are registered on the API, which is bound to an application by create_app()
+api = Api(default="TV Shows",  # Default namespace
           title="TV Shows",  # Documentation Title
           description="API to store TV shows from the external tvmaze API")
 
+# Time every request, and profile it if its 'X-Profile' header carries the profiling token
+def start_request():
+    g.request_start = time.perf_counter()
+    g.profiler = None
+    if PROFILE_TOKEN and hmac.compare_digest(request.headers.get('X-Profile', ''), PROFILE_TOKEN):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request of this process is being profiled
+            return
+        g.profiler = profiler
+
+# Record the request once its body has been sent, since list and export bodies are streamed
+def finish_request(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    rule = request.url_rule.rule if (request.url_rule is not None) else 'unmatched'
+    labels = (('method', request.method), ('endpoint', rule), ('status', response.status_code))
+    profiler = g.get('profiler')
+    if profiler is not None:
+        name = '{}-{}.prof'.format(datetime.now().strftime('%Y%m%d-%H%M%S-%f'), request.endpoint)
+        response.headers['X-Profile-File'] = name
+
+    def finish():
+        registry.observe('request_duration_seconds', labels, time.perf_counter() - start)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(PROFILE_DIR, name))
+
+    response.call_on_close(finish)
+    return response
+
 # Schedule schema
 schedule_model = api.model('Schedule', {
     'time': fields.String,
@@ -56,127 +675,572 @@ shows_model = api.model('Shows', {
     'summary': fields.String
 })
 
-# Query parameter for importing a TV show
-parser = reqparse.RequestParser()
-parser.add_argument('name')
+# TV show update schema for batch updates, which name the TV show to update by its id
+show_update_model = api.inherit('Show Update', shows_model, {
+    'id': fields.Integer(required=True)
+})
+
+# Columns of the TV_Shows table in storage order
+SHOW_COLUMNS = ['tvmaze_id', 'id', 'last_update', 'name', 'type', 'language', 'genres',
+                'status', 'runtime', 'premiered', 'officialSite', 'schedule', 'rating',
+                'weight', 'network', 'summary']
+
+# Columns a TV show update can change, in storage order so that the same set of fields
+# always gives the same statement and reuses the connection's prepared statement
+UPDATE_COLUMNS = [field for field in SHOW_COLUMNS if field in shows_model]
+
+# Convert the fields of a TV show update to column values in storage order;
+# raises ValueError naming the first field that cannot be updated
+def show_update_values(show):
+    for field in show:
+        if field not in shows_model:
+            raise ValueError(field)
+    values = {}
+    for field in UPDATE_COLUMNS:
+        if field in show:
+            value = show[field]
+            if (field == 'rating'):
+                value = (value or {}).get('average')
+            elif field in ['genres', 'schedule', 'network']:
+                value = json.dumps(value)
+            values[field] = value
+    # Keep the normalised name in step with the name
+    if 'name' in values:
+        values['name_key'] = normalise_name(str(values['name']))
+    return values
+
+# Build the update of the given columns and 'last_update' of the TV show ':id'
+def show_update_query(columns):
+    return 'update TV_Shows set ' + ''.join(column + ' = :' + column + ', ' for column in columns)\
+           + 'last_update = :last_update where id = :id'
+
+# Fetch a TV show along with the ids of the previous and next TV shows
+# (both neighbour lookups are single probes of the unique index on 'id')
+SHOW_QUERY = 'select ' + ', '.join(SHOW_COLUMNS) + ',\
+                     (select max(id) from TV_Shows where id < ?1),\
+                     (select min(id) from TV_Shows where id > ?1)\
+              from TV_Shows\
+              where id = ?1'
+
+# Insert a TV show given as a dict of column values
+INSERT_SHOW_QUERY = 'insert into TV_Shows (' + ', '.join(SHOW_COLUMNS) + ', name_key)\
+                     values (' + ', '.join(':' + field for field in SHOW_COLUMNS) + ', :name_key)'
+
+# A single TV show, decoded straight from a show of the tvmaze API or a row of TV_Shows;
+# genres, schedule and network hold their stored JSON text and last_update its epoch seconds
+class ShowRecord:
+
+    __slots__ = SHOW_COLUMNS + ['name_key']
+
+    def __init__(self, **values):
+        for field in self.__slots__:
+            setattr(self, field, values.get(field))
+
+    # Decode a TV show of the tvmaze API; 'id' and 'last_update' are left for the caller to set
+    @classmethod
+    def from_tvmaze(cls, show):
+        runtime = show.get('runtime')
+        weight = show.get('weight')
+        return cls(tvmaze_id=int(show['id']),
+                   name=show['name'],
+                   type=show.get('type'),
+                   language=show.get('language'),
+                   genres=json.dumps(show.get('genres')),
+                   status=show.get('status'),
+                   runtime=int(runtime) if (runtime is not None) else None,
+                   premiered=show.get('premiered'),
+                   officialSite=show.get('officialSite'),
+                   schedule=json.dumps(show.get('schedule')),
+                   rating=(show.get('rating') or {}).get('average'),
+                   weight=int(weight) if (weight is not None) else None,
+                   network=json.dumps(show.get('network')),
+                   summary=show.get('summary'),
+                   name_key=normalise_name(show['name']))
+
+    # Decode a row of TV_Shows holding the given columns, ignoring any extra values
+    @classmethod
+    def from_row(cls, row, columns=SHOW_COLUMNS):
+        return cls(**dict(zip(columns, row)))
+
+    # Get the column values, such as for INSERT_SHOW_QUERY
+    def values(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    # Get the TV show as returned by the API, without its links
+    def to_response(self):
+        return {
+            'tvmaze_id': self.tvmaze_id,
+            'id': self.id,
+            'last_update': format_update(self.last_update),
+            'name': self.name,
+            'type': self.type,
+            'language': self.language,
+            'genres': json.loads(self.genres),
+            'status': self.status,
+            'runtime': self.runtime,
+            'premiered': self.premiered,
+            'officialSite': self.officialSite,
+            'schedule': json.loads(self.schedule),
+            'rating': {
+                'average': self.rating
+            },
+            'weight': self.weight,
+            'network': json.loads(self.network),
+            'summary': self.summary
+        }
+
+# In-process LRU cache of encoded JSON responses; an entry is only served while the
+# TV_Shows table version it was built from is current, so changes made by other
+# processes or threads never serve stale data, and the handlers that change TV shows
+# also drop the affected entries straight away
+class ResponseCache:
+
+    def __init__(self, size, max_body=None, ttl=RESPONSE_CACHE_TTL):
+        self.entries = TTLCache(size, ttl)
+        self.max_body = max_body
+        self._lock = threading.Lock()
+        self.stale = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    # Return the (etag, body, ...) entry cached for 'key' at table version 'version', or None
+    def get(self, key, version):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if (entry[0] != version):
+            self._count('stale')
+            self.entries.delete(key)
+            return None
+        return entry[1:]
+
+    def set(self, key, version, etag, body, *extra):
+        if (self.max_body is None) or (len(body) <= self.max_body):
+            self.entries.set(key, (version, etag, body) + extra)
+
+    # Pass the chunks of a streamed body through, caching the body once it is complete
+    def stream(self, key, version, etag, chunks):
+        body = []
+        size = 0
+        for chunk in chunks:
+            if body is not None:
+                body.append(chunk)
+                size += len(chunk)
+                # Stop collecting a body that is too large to cache
+                if (self.max_body is not None) and (size > self.max_body):
+                    body = None
+            yield chunk
+        if body is not None:
+            self.set(key, version, etag, ''.join(body))
+
+    # Drop the entry for 'key', or every entry
+    def invalidate(self, key=None):
+        self._count('invalidations')
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.delete(key)
+
+    # Send a JSON body with its validators, or 304 if the client already has it. Only the ETag
+    # decides: Last-Modified has a resolution of one second and does not change with the links
+    # to other TV shows, so If-Modified-Since alone could confirm a stale body
+    def respond(self, etag, body, last_modified=None):
+        if request.if_none_match.contains_weak(etag):
+            self._count('not_modified')
+            response = Response(status=304)
+        else:
+            response = Response(body, status=200, mimetype='application/json')
+        response.set_etag(etag)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        # Clients may keep the response but must revalidate it before using it
+        response.cache_control.no_cache = True
+        return response
+
+    def stats(self):
+        stats = self.entries.stats()
+        with self._lock:
+            # Entries found but built from an older table version are misses
+            stats['hits'] -= self.stale
+            stats['misses'] += self.stale
+            stats['stale'] = self.stale
+            stats['not_modified'] = self.not_modified
+            stats['invalidations'] = self.invalidations
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else None
+        return stats
+
+# Encoded responses of GET /tv-shows/<id> by id, and of GET /tv-shows and GET /tv-shows/search
+# by query string
+show_cache = ResponseCache(SHOW_CACHE_SIZE)
+page_cache = ResponseCache(PAGE_CACHE_SIZE, PAGE_CACHE_MAX_BODY)
+
+# Look up the page cached under 'key' for the current TV_Shows table version and return the
+# version, the ETag of the page and, if the page or a 304 can be sent without building it,
+# the response; the ETag of a page is derived from the key and the table version
+def cached_page(key):
+    with pool.connection() as conn, span('sql.table_version'):
+        version = table_version(conn)
+    etag = hashlib.sha1('{} {}'.format(version, key).encode()).hexdigest()
+    cached = page_cache.get(key, version)
+    if cached is not None:
+        return version, etag, page_cache.respond(*cached)
+    if request.if_none_match.contains_weak(etag):
+        return version, etag, page_cache.respond(etag, '')
+    return version, etag, None
+
+# Drop the cached responses affected by a change to the TV show 'id', or to any TV show;
+# inserting or deleting a TV show also changes the links of its neighbours
+def invalidate_responses(id=None):
+    if id is None:
+        show_cache.invalidate()
+    else:
+        show_cache.invalidate(id)
+    page_cache.invalidate()
+
+# Search the tvmaze API for a TV show and return it as a ShowRecord, or None if no
+# TV show matches the name (ignoring spacing, hyphens and case)
+def find_show(name):
+    with span('tvmaze.search'):
+        results = tvmaze.search_shows(name)
+    name_key = normalise_name(name)
+    with span('decode.find_show'):
+        # Decode the first matching TV show only
+        for result in results:
+            if (normalise_name(result['show']['name']) == name_key):
+                return ShowRecord.from_tvmaze(result['show'])
+    return None
+
+# Import the TV show 'name' from the tvmaze API and return the response body and status
+def import_show(name):
+    # Search the tvmaze API for the TV show
+    try:
+        show = find_show(name)
+    except UpstreamError:
+        return {"message": "The tvmaze API is unavailable"}, 502
+    # If requested TV show name does not match any TV shows from the tvmaze API
+    if show is None:
+        return {"message": "Invalid TV show"}, 400
+
+    show.last_update = int(time.time())
+
+    with pool.connection() as conn:
+        # If the TV show matches any TV shows already stored
+        with span('sql.duplicate_check'):
+            duplicate = conn.execute('select 1 from TV_Shows where name_key = ?', (show.name_key,)).fetchone()
+        if duplicate is not None:
+            return {"message": "TV show already exists in database"}, 400
+
+        # Create the unique id and insert the TV show in one transaction so concurrent
+        # imports never share an id; a concurrent import of the same TV show
+        # violates the unique index on 'name_key'
+        try:
+            with span('sql.insert'), transaction(conn):
+                show.id = allocate_ids(conn, 'TV_Shows')[0]
+                conn.execute(INSERT_SHOW_QUERY, show.values())
+        except sqlite3.IntegrityError:
+            return {"message": "TV show already exists in database"}, 400
+    invalidate_responses()
+
+    # Generate response body
+    href = 'http://127.0.0.1:5000/tv-shows/import?name='
+    for word in name.split():
+        href += word
+        href += '%20'
+    if (name != ''):
+        href = href[0:-3]
+    response = {
+        'id': show.id,
+        'last_update': format_update(show.last_update),
+        'tvmaze_id': show.tvmaze_id,
+        '_links': {
+            'self': {
+                'href': href
+            }
+        }
+    }
+
+    return response, 201
+
+# Get an import job as returned by the API, or None if there is no such job
+def read_import_job(conn, id):
+    row = conn.execute('select id, name, status, created, updated, result_status, result\
+                        from Import_Jobs where id = ?', (id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(zip(['id', 'name', 'status', 'created', 'updated'], row[:5]))
+    job['result'] = dict(json.loads(row[6]), status=row[5]) if (row[6] is not None) else None
+    job['_links'] = {
+        'self': {
+            'href': 'http://127.0.0.1:5000/tv-shows/import/jobs/' + str(id)
+        }
+    }
+    if (row[5] == 201):
+        job['_links']['tv_show'] = {
+            'href': 'http://127.0.0.1:5000/tv-shows/' + str(job['result']['id'])
+        }
+    return job
+
+# Queue of asynchronous imports, persisted in the Import_Jobs table so that any process
+# can report on them, and run by a pool of worker threads in each process
+class ImportQueue:
+
+    def __init__(self, workers=IMPORT_WORKERS, ttl=IMPORT_JOB_TTL):
+        self.workers = workers
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def _count(self, **counts):
+        with self._lock:
+            for counter, count in counts.items():
+                setattr(self, counter, getattr(self, counter) + count)
+
+    def _schedule(self, id):
+        with self._lock:
+            # Threads do not survive a fork, so each process starts its own workers
+            if (self._pid != os.getpid()):
+                self._pid = os.getpid()
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import')
+            self._executor.submit(self._run, id)
+
+    # Queue the import of the TV show 'name' and return the job and whether it was coalesced
+    # with a pending or running job for the same TV show
+    def submit(self, name):
+        now = datetime.now()
+        expired = (now - timedelta(seconds=self.ttl)).strftime('%Y-%m-%d %H:%M:%S')
+        now = now.strftime('%Y-%m-%d %H:%M:%S')
+        with pool.connection() as conn:
+            with span('sql.import_job_submit'), transaction(conn):
+                row = conn.execute("select id from Import_Jobs where name_key = ? and status in ('pending', 'running')",
+                                   (normalise_name(name),)).fetchone()
+                coalesced = row is not None
+                if coalesced:
+                    id = row[0]
+                else:
+                    conn.execute("delete from Import_Jobs where status in ('completed', 'failed') and updated < ?",
+                                 (expired,))
+                    id = conn.execute("insert into Import_Jobs (name, name_key, status, created, updated)\
+                                       values (?, ?, 'pending', ?, ?)", (name, normalise_name(name), now, now)).lastrowid
+            job = read_import_job(conn, id)
+        if coalesced:
+            self._count(coalesced=1)
+        else:
+            self._count(submitted=1)
+            self._schedule(id)
+        return job, coalesced
+
+    def _run(self, id):
+        with pool.connection() as conn:
+            # Claim the job, which another process may have resumed first
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            claimed = conn.execute("update Import_Jobs set status = 'running', updated = ?\
+                                    where id = ? and status = 'pending'", (now, id)).rowcount
+            if not claimed:
+                return
+            name = conn.execute('select name from Import_Jobs where id = ?', (id,)).fetchone()[0]
+        self._count(running=1)
+        try:
+            body, status = import_show(name)
+        except Exception:
+            import_log.exception('Importing %r failed', name)
+            body, status = {"message": "Internal error"}, 500
+        with pool.connection() as conn:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            conn.execute('update Import_Jobs set status = ?, updated = ?, result_status = ?, result = ?\
+                          where id = ?', ('completed' if (status == 201) else 'failed', now, status,
+                                          json.dumps(body), id))
+        if (status == 201):
+            self._count(running=-1, completed=1)
+        else:
+            self._count(running=-1, failed=1)
+
+    # Mark the jobs left running by stopped processes as pending; only safe while no
+    # process is serving the database
+    def recover(self):
+        with pool.connection() as conn:
+            conn.execute("update Import_Jobs set status = 'pending' where status = 'running'")
+
+    # Run the pending jobs, such as those queued by a process that stopped
+    def resume(self):
+        with pool.connection() as conn:
+            ids = [id for id, in conn.execute("select id from Import_Jobs where status = 'pending' order by id")]
+        for id in ids:
+            self._schedule(id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'running': self.running,
+                'completed': self.completed,
+                'failed': self.failed
+            }
+
+import_log = logging.getLogger('tv_shows.import')
+import_queue = ImportQueue()
+
+# Query parameters for importing a TV show
+import_parser = reqparse.RequestParser()
+import_parser.add_argument('name')
+import_parser.add_argument('async')
 
 @api.route('/tv-shows/import')
 @api.param('name', 'The TV show name')
+@api.param('async', "'true' to queue the import and poll its job instead of waiting for it")
 class ShowsImport(Resource):
 
     @api.response(201, 'TV Show Created Successfully')
+    @api.response(202, 'TV Show Import Queued, see the job for its progress')
     @api.response(400, 'Bad Request')
+    @api.response(502, 'The tvmaze API is unavailable')
     @api.doc(description="Add a new TV show")
     def post(self):
         # Get TV show name from query parameter
-        args = parser.parse_args()
+        args = import_parser.parse_args()
         name = args.get('name')
-        conn = sqlite3.connect("z5207370.db")
-        # Construct query
-        query = 'http://api.tvmaze.com/search/shows?q='
-        for word in name.split():
-            query += word
-            query += '%20'
-        # Remove last ascii space if no name is given in the request
-        if (name != ''):
-            query = query[0:-3]
-        # Convert query result to dataframe
-        df = pd.read_json(query)
-        # Flatten 'shows' field
-        df = df.join(df['show'].apply(pd.Series))
-        # Get all rows that match search name
-        name_reformatted = name.replace(' ', '_')
-        name_reformatted = name_reformatted.replace('-', '_')
-        name_reformatted = name_reformatted.lower()
-        df_name_copy = df[['id', 'name']].copy()
-        df_name_copy.columns = ['id', 'name_old']
-        df['name'] = df['name'].apply(lambda x: x.replace(' ', '_'))
-        df['name'] = df['name'].apply(lambda x: x.replace('-', '_'))
-        df['name'] = df['name'].apply(lambda x: x.lower())
-        df = df[df['name'] == name_reformatted]
-        df = df.merge(df_name_copy, on='id')
-
-        # If requested TV show name does not match any TV shows from the tvmaze API
-        if (df.shape[0] == 0):
+        if not name:
             return {"message": "Invalid TV show"}, 400
+        if (args.get('async') in ['1', 'true']):
+            job, coalesced = import_queue.submit(name)
+            return job, 202, {'Location': job['_links']['self']['href']}
+        return import_show(name)
 
-        # If the TV show matches any TV shows already stored
-        shows = pd.read_sql_query('select * from TV_Shows', con=conn)
-        shows['name'] = shows['name'].apply(lambda x: x.replace(' ', '_'))
-        shows['name'] = shows['name'].apply(lambda x: x.replace('-', '_'))
-        shows['name'] = shows['name'].apply(lambda x: x.lower())
-        shows = shows[shows['name'] == name_reformatted]
-        if (shows.shape[0] > 0):
-            return {"message": "TV show already exists in database"}, 400
-            
-        # Get first matching row
-        df = df[['id', 'name_old', 'type', 'language', 'genres', 'status', 'runtime',\
-                 'premiered', 'officialSite', 'schedule', 'rating', 'weight',\
-                 'network', 'summary']].iloc[0].to_frame().transpose()
-        df.columns = ['tvmaze_id', 'name', 'type', 'language', 'genres', 'status', 
-                      'runtime', 'premiered', 'officialSite', 'schedule', 'rating',\
-                      'weight', 'network', 'summary']
-
-        # Cast 'tvmaze_id' to int
-        df['tvmaze_id'] = int(df['tvmaze_id'].iloc[0])
-        # Cast 'runtime' to int
-        if not pd.isna(df['runtime'].iloc[0]):
-            df['runtime'] = int(df['runtime'].iloc[0])
-        # Cast 'weight' to int
-        if not pd.isna(df['weight'].iloc[0]):
-            df['weight'] = int(df['weight'].iloc[0])
-
-        # Convert json object for genres to json string
-        df['genres'] = df['genres'].apply(lambda x: json.dumps(x))
-        # Convert json object for schedule to json string
-        df['schedule'] = df['schedule'].apply(lambda x: json.dumps(x))
-        # Convert json object for rating to just the average value
-        df['rating'] = df['rating'].apply(lambda x: x['average'])
-        # Convert json object for network to json string
-        df['network'] = df['network'].apply(lambda x: json.dumps(x))
-
-        # Create unique id for tv show
-        id = pd.read_sql_query('select max(id) from TV_Shows', con=conn)
-        id = id['max(id)'].iloc[0]
-        if (id is None):
-            id = 0
-        else:
-            id += 1
-        # Add id to dataframe
-        df['id'] = id
+@api.route('/tv-shows/import/jobs/<int:id>')
+class ShowsImportJob(Resource):
 
-        # Get current date and time and format
-        now = datetime.now()
-        now = now.strftime('%Y-%m-%d %H:%M:%S')
-        # Add current date and time to dataframe
-        df['last_update'] = now
-
-        # Reorder columns
-        df = df[['tvmaze_id', 'id', 'last_update', 'name', 'type', 'language', 'genres', 
-                 'status', 'runtime', 'premiered', 'officialSite', 'schedule', 'rating', 
-                 'weight', 'network', 'summary']]
-        pd.io.sql.to_sql(df, name="TV_Shows", con=conn, if_exists='append', index=False)
-        conn.close()
-
-        # Generate response body
-        href = 'http://127.0.0.1:5000/tv-shows/import?name='
-        for word in name.split():
-            href += word
-            href += '%20'
-        if (name != ''):
-            href = href[0:-3]
-        response = {
-            'id': df['id'].iloc[0].item(),
-            'last_update': df['last_update'].iloc[0],
-            'tvmaze_id': df['tvmaze_id'].iloc[0].item(),
-            '_links': {
-                'self': {
-                    'href': href
+    @api.response(200, 'Import Job Successfully retrieved')
+    @api.response(404, 'Import Job not found')
+    @api.doc(description="Retrieve the progress and, once finished, the result of an asynchronous import")
+    def get(self, id):
+        job = None
+        if valid_id(id):
+            with pool.connection() as conn:
+                job = read_import_job(conn, id)
+        if job is None:
+            return {"message": "Import job not found"}, 404
+        return job, 200
+
+# Read the TV show names of a batch import from a JSON list, a JSON object with
+# a 'names' list or an NDJSON stream; entries are names or objects with a 'name'
+def parse_batch_names():
+    if (request.mimetype in ['application/x-ndjson', 'application/jsonl']):
+        entries = []
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    else:
+        entries = request.get_json(force=True)
+        if isinstance(entries, dict):
+            entries = entries.get('names')
+    if not isinstance(entries, list):
+        raise ValueError('Expected a list of TV show names')
+    names = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            entry = entry.get('name')
+        names.append(entry)
+    return names
+
+@api.route('/tv-shows/import/batch')
+class ShowsImportBatch(Resource):
+
+    @api.response(200, 'Batch Processed, see the status of each TV show')
+    @api.response(400, 'Bad Request')
+    @api.doc(description="Add many TV shows given as a JSON list of names or an NDJSON stream")
+    def post(self):
+        # Get TV show names from the request body
+        try:
+            names = parse_batch_names()
+        except ValueError:
+            return {"message": "Request body must be a list of TV show names"}, 400
+        if (len(names) > BATCH_IMPORT_LIMIT):
+            return {"message": "At most {} TV shows can be imported at once".format(BATCH_IMPORT_LIMIT)}, 400
+
+        # Skip invalid names and names repeated within the batch
+        results = [None] * len(names)
+        batch = {}
+        for index, name in enumerate(names):
+            if not isinstance(name, str) or not name.strip():
+                results[index] = {'name': name, 'status': 400, 'message': 'Invalid TV show'}
+            elif normalise_name(name) in batch:
+                results[index] = {'name': name, 'status': 400, 'message': 'TV show already in this batch'}
+            else:
+                batch[normalise_name(name)] = index
+
+        # Search the tvmaze API for all TV shows concurrently
+        with span('tvmaze.batch_search'), ThreadPoolExecutor(max_workers=BATCH_IMPORT_WORKERS) as executor:
+            searches = [(index, executor.submit(find_show, names[index])) for index in batch.values()]
+        found = []
+        for index, search in searches:
+            try:
+                show = search.result()
+            except UpstreamError:
+                results[index] = {'name': names[index], 'status': 502, 'message': 'The tvmaze API is unavailable'}
+                continue
+            if show is None:
+                results[index] = {'name': names[index], 'status': 400, 'message': 'Invalid TV show'}
+            else:
+                found.append((index, show))
+
+        now = int(time.time())
+
+        # Insert all new TV shows in one transaction
+        created = []
+        with pool.connection() as conn, span('sql.batch_insert'), transaction(conn):
+            # Skip TV shows already stored
+            existing = set(key for key, in select_in(conn, 'select name_key from TV_Shows where name_key in',
+                                                     [show.name_key for index, show in found]))
+            for index, show in found:
+                if show.name_key in existing:
+                    results[index] = {'name': names[index], 'status': 400, 'message': 'TV show already exists in database'}
+                else:
+                    created.append((index, show))
+
+            # Create unique ids for the new TV shows and insert them
+            if created:
+                for (index, show), id in zip(created, allocate_ids(conn, 'TV_Shows', len(created))):
+                    show.id = id
+                    show.last_update = now
+                conn.executemany(INSERT_SHOW_QUERY, [show.values() for index, show in created])
+        if created:
+            invalidate_responses()
+
+        for index, show in created:
+            results[index] = {
+                'name': names[index],
+                'status': 201,
+                'id': show.id,
+                'last_update': format_update(show.last_update),
+                'tvmaze_id': show.tvmaze_id,
+                '_links': {
+                    'self': {
+                        'href': 'http://127.0.0.1:5000/tv-shows/' + str(show.id)
+                    }
                 }
             }
+
+        # Generate response
+        response = {
+            'total': len(names),
+            'created': len(created),
+            'results': results
         }
 
-        return response, 201
+        return response, 200
 
 @api.route('/tv-shows/<int:id>')
 class Shows(Resource):
@@ -185,45 +1249,28 @@ class Shows(Resource):
     @api.response(200, 'Successful')
     @api.doc(description="Get a TV show by its ID")
     def get(self, id):
-        # Get all rows (only one row since id is unique) matching the supplied id
-        conn = sqlite3.connect('z5207370.db')
-        show = pd.read_sql_query('select * from TV_Shows where id=' + str(id), con=conn)
+        if not valid_id(id):
+            return "TV show of id '{}' doesn't exist".format(id), 404
+        # Serve the cached response unless a TV show has changed since it was built; the
+        # version is read first so that a cached response is never newer than its version
+        with pool.connection() as conn:
+            with span('sql.table_version'):
+                version = table_version(conn)
+            cached = show_cache.get(id, version)
+            if cached is None:
+                # Get the TV show and the ids of its neighbours in a single query
+                with span('sql.show'):
+                    show = conn.execute(SHOW_QUERY, (id,)).fetchone()
+        if cached is not None:
+            return show_cache.respond(*cached)
         # If no TV show in the database matches the requested id
-        if (show.shape[0] == 0):
+        if show is None:
             return "TV show of id '{}' doesn't exist".format(id), 404
-        
-        # Bypass errors for non JSON serializable data types
-        runtime = show['runtime'].iloc[0]
-        rating = show['rating'].iloc[0]
-        weight = show['weight'].iloc[0]
-        if runtime is not None:
-            runtime = runtime.item()
-        if rating is not None:
-            rating = rating.item()
-        if weight is not None:
-            weight = weight.item()
 
         # Generate response
-        response = {
-            'tvmaze_id': show['tvmaze_id'].iloc[0].item(),
-            'id': show['id'].iloc[0].item(),
-            'last_update': show['last_update'].iloc[0],
-            'name': show['name'].iloc[0],
-            'type': show['type'].iloc[0],
-            'language': show['language'].iloc[0],
-            'genres': json.loads(show['genres'].iloc[0]),
-            'status': show['status'].iloc[0],
-            'runtime': runtime,
-            'premiered': show['premiered'].iloc[0],
-            'officialSite': show['officialSite'].iloc[0],
-            'schedule': json.loads(show['schedule'].iloc[0]),
-            'rating': {
-                'average': rating
-            },
-            'weight': weight,
-            'network': json.loads(show['network'].iloc[0]),
-            'summary': show['summary'].iloc[0]
-        }
+        prev, next = show[-2:]
+        show = ShowRecord.from_row(show)
+        response = show.to_response()
 
         # Generate _links field
         _links = {
@@ -231,42 +1278,43 @@ class Shows(Resource):
                 'href': 'http://127.0.0.1:5000/tv-shows/' + str(id)
             }
         }
-        # Get the previous link if one exists
-        prev = pd.read_sql_query('select * from TV_Shows where id<' + str(id) + ' order by id desc', con=conn)
-        if (prev.shape[0] > 0):
+        # Add the previous link if one exists
+        if prev is not None:
             _links['previous'] = {
-                'href': 'http://127.0.0.1:5000/tv-shows/' + str(prev['id'].iloc[0])
+                'href': 'http://127.0.0.1:5000/tv-shows/' + str(prev)
             }
-        next = pd.read_sql_query('select * from TV_Shows where id>' + str(id) + ' order by id asc', con=conn)
-        if (next.shape[0] > 0):
+        # Add the next link if one exists
+        if next is not None:
             _links['next'] = {
-                'href': 'http://127.0.0.1:5000/tv-shows/' + str(next['id'].iloc[0])
+                'href': 'http://127.0.0.1:5000/tv-shows/' + str(next)
             }
-        
+
         # Add _links to the response
         response['_links'] = _links
-        
-        conn.close()
 
-        return response, 200
+        # The ETag is a digest of the body, so it also changes with the neighbour links;
+        # Last-Modified is the time the TV show itself last changed
+        with span('json.show'):
+            body = json.dumps(response) + '\n'
+        etag = hashlib.sha1(body.encode()).hexdigest()
+        last_modified = datetime.fromtimestamp(show.last_update, timezone.utc)
+        show_cache.set(id, version, etag, body, last_modified)
+
+        return show_cache.respond(etag, body, last_modified)
 
     @api.response(404, 'TV show was not found')
     @api.response(200, 'Successful')
     @api.doc(description="Delete a TV show by its ID")
     def delete(self, id):
-        # Check if the TV show exists
-        conn = sqlite3.connect('z5207370.db')
-        show = pd.read_sql_query('select * from TV_Shows where id=' + str(id), con=conn)
-        # If no TV show in the database matches the requested id
-        if (show.shape[0] == 0):
+        if not valid_id(id):
             return "TV show of id '{}' doesn't exist".format(id), 404
-
         # Delete TV show from database matching id
-        c = conn.cursor()
-        c.execute('delete from TV_Shows\
-                       where id=' + str(id))
-        conn.commit()
-        conn.close()
+        with pool.connection() as conn, span('sql.delete'):
+            deleted = conn.execute('delete from TV_Shows where id = ?', (id,)).rowcount
+        # If no TV show in the database matches the requested id
+        if not deleted:
+            return "TV show of id '{}' doesn't exist".format(id), 404
+        invalidate_responses()
 
         # Generate response
         response = {
@@ -282,52 +1330,34 @@ class Shows(Resource):
     @api.doc(description="Update a TV show by its ID")
     @api.expect(shows_model, validate=True)
     def patch(self, id):
-        # Check if the TV show exists
-        conn = sqlite3.connect('z5207370.db')
-        show = pd.read_sql_query('select * from TV_Shows where id=' + str(id), con=conn)
-        # If no TV show in the database matches the requested id
-        if (show.shape[0] == 0):
+        # Get request payload as column values
+        try:
+            values = show_update_values(request.json)
+        except ValueError as error:
+            return "Field '{}' is invalid".format(error), 400
+        if not valid_id(id):
             return "TV show of id '{}' doesn't exist".format(id), 404
 
-        # Get request payload
-        show = request.json
-
-        # Check for extra payload fields
-        for field in show:
-            if field not in shows_model:
-                return "Field '{}' is invalid".format(field), 400
-
-        # Get current date and time and format
-        now = datetime.now()
-        now = now.strftime('%Y-%m-%d %H:%M:%S')
-
-        # Construct sql query to update database
-        c = conn.cursor()
-        query = 'update TV_Shows set '
-        for field in show:
-            # Format the data
-            data = "'"
-            if (field == 'rating'):
-                data += str(show['rating']['average'])
-            elif (field == 'weight'):
-                data += str(show[field])
-            elif (field == 'schedule' or field == 'rating' or field == 'network' or field == 'genres'):
-                data += json.dumps(show[field])
-            else:
-                data += str(show[field])
-            query += field + ' = ' + data + "', "
-        # Add last_update field to query
-        query += "last_update = '" + now + "' where id = " + str(id)
+        now = int(time.time())
 
-        # Execute query
-        c.execute(query)
-        conn.commit()
-        conn.close()
+        # Update the TV show; no row is changed if no TV show in the database matches the id
+        query = show_update_query(values)
+        values['id'] = id
+        values['last_update'] = now
+        with pool.connection() as conn:
+            try:
+                with span('sql.update', query):
+                    updated = conn.execute(query, values).rowcount
+            except sqlite3.IntegrityError:
+                return "TV show '{}' already exists in database".format(values['name']), 400
+        if (updated == 0):
+            return "TV show of id '{}' doesn't exist".format(id), 404
+        invalidate_responses(id)
 
         # Generate response
         response = {
             'id': id,
-            'last_update': now,
+            'last_update': format_update(now),
             '_links': {
                 'self': {
                     'href': 'http://127.0.0.1:5000/tv-shows/' + str(id)
@@ -338,16 +1368,167 @@ class Shows(Resource):
         return response, 200
 
 # Query arguments for retrieving a list of available TV shows
-parser.add_argument('order_by')
-parser.add_argument('page')
-parser.add_argument('page_size')
-parser.add_argument('filter')
+list_parser = reqparse.RequestParser()
+list_parser.add_argument('order_by')
+list_parser.add_argument('page')
+list_parser.add_argument('page_size')
+list_parser.add_argument('filter')
+list_parser.add_argument('after')
+list_parser.add_argument('genre')
+list_parser.add_argument('ids')
+
+# Condition matching the TV shows with a given genre through the Show_Genres index
+GENRE_CONDITION = 'id in (select show_id from Show_Genres where genre = ?)'
+
+# Fields TV shows can be ordered by
+ORDER_FIELDS = ['id', 'name', 'runtime', 'premiered', 'rating']
+
+# Parse an 'order_by' parameter such as '+rating,-name' into a list of (field, direction)
+# sort keys; 'id' is added last so the order is total and pages never overlap, following
+# the direction of the last field so a single index on (field, id) covers the order
+def parse_order_by(order_by):
+    order = {}
+    for entry in order_by.split(','):
+        field = entry[1:]
+        if (entry[:1] == '+'):
+            order[field] = 'asc'
+        elif (entry[:1] == '-'):
+            order[field] = 'desc'
+        else:
+            raise ValueError("Parameter 'order_by' is invalid: first part must either be '+' or '-'")
+    # Check 'order_by' fields are valid
+    for field in order:
+        if field not in ORDER_FIELDS:
+            raise ValueError("Order_by field '{}' is invalid".format(field))
+    sort_keys = list(order.items())
+    if 'id' not in order:
+        sort_keys.append(('id', sort_keys[-1][1]))
+    return sort_keys
+
+# Parse the 'page' and 'page_size' parameters into positive ints small enough for the limit
+# and offset of a page to be SQLite integers; raises ValueError otherwise
+def parse_page(page, page_size):
+    if not (page.isdigit() and page_size.isdigit()):
+        raise ValueError("Parameters 'page' and 'page_size' must be positive")
+    page = int(page)
+    page_size = int(page_size)
+    if (page < 1) or (page_size < 1) or (page * page_size >= MAX_INTEGER):
+        raise ValueError("Parameters 'page' and 'page_size' must be positive")
+    return page, page_size
+
+# Parse a 'filter' parameter such as 'id,name' into a list of fields
+def parse_filter(filter):
+    fields = filter.split(',')
+    # Check filters are valid
+    for field in fields:
+        if field not in SHOW_COLUMNS:
+            raise ValueError("Filter '{}' is invalid".format(field))
+    return fields
+
+# Fields that can never be NULL, so keyset conditions do not need NULL handling for them
+NOT_NULL_FIELDS = ['id', 'name']
+
+# Build a where clause matching the rows that come after the row with sort key 'values'
+# in the order given by 'sort_keys' (SQLite puts NULLs first ascending, last descending)
+def keyset_condition(sort_keys, values):
+    # Bound the first sort field so the query can seek on its index
+    field, direction = sort_keys[0]
+    value = values[0]
+    nullable = field not in NOT_NULL_FIELDS
+    if value is None:
+        bound = field + ' is null' if (direction == 'desc') else '1'
+    elif (direction == 'asc'):
+        bound = field + ' >= ?'
+    else:
+        bound = '(' + field + ' <= ? or ' + field + ' is null)' if nullable else field + ' <= ?'
+    params = [] if value is None else [value]
+
+    # Rows that tie on every earlier sort field and come after on this one
+    clauses = []
+    equal = []
+    equal_params = []
+    for (field, direction), value in zip(sort_keys, values):
+        nullable = field not in NOT_NULL_FIELDS
+        if value is None:
+            after = field + ' is not null' if (direction == 'asc') else None
+        elif (direction == 'asc'):
+            after = field + ' > ?'
+        else:
+            after = '(' + field + ' < ? or ' + field + ' is null)' if nullable else field + ' < ?'
+        if after is not None:
+            clauses.append('(' + ' and '.join(equal + [after]) + ')')
+            params += equal_params + ([] if value is None else [value])
+        equal.append(field + ' is ?')
+        equal_params.append(value)
+
+    return bound + ' and (' + (' or '.join(clauses) or '0') + ')', params
+
+# Number of TV shows encoded at a time when streaming a response
+STREAM_CHUNK_SIZE = 500
+
+# Fields stored as JSON strings, decoded before they are returned
+JSON_FIELDS = ['genres', 'schedule', 'network']
+
+# Decode a JSON string column, keeping NULLs; the column values are written by
+# json.dumps, so the decoder is called directly without json.loads' checks
+json_decoder = json.JSONDecoder()
+
+def decode_json(value):
+    return None if value is None else json_decoder.raw_decode(value)[0]
+
+# Return a function turning a row whose leading columns are 'fields' into a dict,
+# decoding JSON string columns and formatting 'last_update' once per row
+def show_decoder(fields):
+    json_columns = [index for index, field in enumerate(fields) if field in JSON_FIELDS]
+    update_column = fields.index('last_update') if 'last_update' in fields else None
+    count = len(fields)
+    if not json_columns and update_column is None:
+        return lambda row: dict(zip(fields, row))
+
+    def decode(row):
+        values = list(row[:count])
+        for index in json_columns:
+            values[index] = decode_json(values[index])
+        if update_column is not None:
+            values[update_column] = format_update(values[update_column])
+        return dict(zip(fields, values))
+    return decode
+
+# Encode the sort key of the last TV show of a page as an opaque 'after' token
+def encode_after(values, sort_keys):
+    token = json.dumps([[field + ' ' + direction for field, direction in sort_keys], list(values)])
+    return base64.urlsafe_b64encode(token.encode()).decode().rstrip('=')
+
+# Decode an 'after' token into a sort key, or None for the first page
+def decode_after(token, sort_keys):
+    if (token == ''):
+        return None
+    try:
+        token = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        order, values = json.loads(token)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid after token')
+    # The token must come from a page with the same order
+    if (order != [field + ' ' + direction for field, direction in sort_keys]) or not isinstance(values, list)\
+            or (len(values) != len(sort_keys)):
+        raise ValueError('Invalid after token')
+    # and hold values that can be bound to the keyset query
+    for value in values:
+        if not (value is None or type(value) in [int, float, str]):
+            raise ValueError('Invalid after token')
+        if (type(value) == int) and not (-MAX_INTEGER - 1 <= value <= MAX_INTEGER):
+            raise ValueError('Invalid after token')
+    return values
 
 @api.route('/tv-shows')
 @api.param('order_by', 'The way the TV shows are ordered')
 @api.param('page', 'The page number')
 @api.param('page_size', 'The page size')
 @api.param('filter', 'The fields to be displayed')
+@api.param('genre', 'Only TV shows of this genre')
+@api.param('after', "Cursor pagination: the 'after' token of the previous page, empty for the first page")
+@api.param('ids', "Comma separated IDs of TV shows to get in this order instead of a page; "
+                  "'filter' defaults to every field, and missing TV shows are given as {'id', 'error': 'not_found'}")
 class ShowsDisplay(Resource):
 
     @api.response(200, 'TV Shows Successfully retrieved')
@@ -355,6 +1536,12 @@ class ShowsDisplay(Resource):
     @api.response(404, 'TV Shows not found')
     @api.doc(description="Retrieve all available TV show based off of parameter(s)")
     def get(self):
+        # Serve the cached page unless a TV show has changed since it was built
+        key = request.query_string.decode()
+        version, etag, response = cached_page(key)
+        if response is not None:
+            return response
+
         # Define default parameters
         params = {
             'order_by': "+id",
@@ -364,135 +1551,482 @@ class ShowsDisplay(Resource):
         }
 
         # Get parameters from query
-        args = parser.parse_args()
+        args = list_parser.parse_args()
+        if args.get('ids') is not None:
+            return self.get_by_ids(args, key, version, etag)
         args_check = False
         if args.get('order_by') is not None:
             params['order_by'] = args.get('order_by')
             args_check = True
-        if args.get('page') is not None:
-            params['page'] = int(args.get('page'))
-            args_check = True
-        if args.get('page_size') is not None:
-            params['page_size'] = int(args.get('page_size'))
+        if (args.get('page') is not None) or (args.get('page_size') is not None):
             args_check = True
+        page = args.get('page') if args.get('page') is not None else str(params['page'])
+        page_size = args.get('page_size') if args.get('page_size') is not None else str(params['page_size'])
+        try:
+            params['page'], params['page_size'] = parse_page(page, page_size)
+        except ValueError as error:
+            return str(error), 400
         if args.get('filter') is not None:
             params['filter'] = args.get('filter')
             args_check = True
+        if args.get('genre') is not None:
+            args_check = True
+        # Cursor pagination is used when 'after' is given (empty for the first page)
+        cursor = args.get('after') is not None
+        if cursor:
+            args_check = True
 
-        # Reformat 'order_by' parameter
-        params['order_by'] = params['order_by'].split(',')
-        order_reformatted = {}
-        for entry in params['order_by']:
-            field = entry[1:]
-            if (entry[0] == '+'):
-                order_reformatted[field] = 'asc'
-            elif (entry[0] == '-'):
-                order_reformatted[field] = 'desc'
-            else:
-                return "Parameter 'order_by' is invalid: first part must either be '+' or '-'", 400
-        
-        # Check 'order_by' fields are valid
-        for field in order_reformatted:
-            if field not in ['id', 'name', 'runtime', 'premiered', 'rating']:
-                return "Order_by field '{}' is invalid".format(field), 400
-
-        # Reformat 'filter' parameter
-        params['filter'] = params['filter'].split(',')
-
-        # Check filters are valid
-        for field in params['filter']:
-            if field not in ['tvmaze_id', 'id', 'last_update', 'name', 'type', 'language', 'genres', 
-                             'status', 'runtime', 'premiered', 'officialSite', 'schedule', 'rating', 
-                             'weight', 'network', 'summary']:
-                return "Filter '{}' is invalid".format(field), 400
+        # Reformat and check 'order_by' and 'filter' parameters
+        try:
+            sort_keys = parse_order_by(params['order_by'])
+            params['filter'] = parse_filter(params['filter'])
+        except ValueError as error:
+            return str(error), 400
+
+        # Construct query, selecting the sort fields after the filtered fields
+        query = 'select ' + ', '.join(params['filter'] + [field for field, direction in sort_keys])
+        query += ' from TV_Shows'
+        conditions = []
+        query_params = []
+        # Only get the TV shows of the requested genre, found through the genre index
+        if args.get('genre') is not None:
+            conditions.append(GENRE_CONDITION)
+            query_params.append(args.get('genre'))
+        if cursor:
+            # Only get the TV shows after the last one of the previous page
+            try:
+                after = decode_after(args.get('after'), sort_keys)
+            except ValueError:
+                return "Parameter 'after' is invalid", 400
+            if after is not None:
+                condition, condition_params = keyset_condition(sort_keys, after)
+                conditions.append(condition)
+                query_params += condition_params
+        if conditions:
+            query += ' where ' + ' and '.join(conditions)
+        query += ' order by ' + ', '.join(field + ' ' + direction for field, direction in sort_keys)
+        # Get one more TV show than needed to find out whether there is a next page
+        query += ' limit ' + str(params['page_size'] + 1)
+        if not cursor:
+            query += ' offset ' + str((params['page'] - 1) * params['page_size'])
+
+        # Construct '_links' response field and the next 'after' token, given whether
+        # there is a next page and the sort key of the last TV show on this page
+        def page_links(has_next, last_key):
+            # Construct '_links['self']' response field
+            self_url = 'http://127.0.0.1:5000/tv-shows'
+            if args_check:
+                self_url += '?'
+                for param in ['order_by', 'page', 'page_size', 'filter', 'genre', 'after']:
+                    if args.get(param) is not None:
+                        self_url += param + '=' + str(args.get(param)) + '&'
+                self_url = self_url[0:-1]
+            links = {
+                'self': {
+                    'href': self_url
+                }
+            }
+            # Construct '_links['previous']' response field if it exists
+            if not cursor and (params['page'] > 1):
+                prev_url = 'http://127.0.0.1:5000/tv-shows?'
+                for param in ['order_by', 'page', 'page_size', 'filter', 'genre']:
+                    if args.get(param) is not None:
+                        if (param == 'page'):
+                            prev_url += 'page' + '=' + str(params['page'] - 1) + '&'
+                        else:
+                            prev_url += param + '=' + str(args.get(param)) + '&'
+                prev_url = prev_url[0:-1]
+                links['previous'] = {
+                    'href': prev_url
+                }
+            # Construct '_links['next']' response field if it exists
+            next_after = None
+            if has_next and cursor:
+                next_after = encode_after(last_key, sort_keys)
+                next_url = 'http://127.0.0.1:5000/tv-shows?'
+                for param in ['order_by', 'page_size', 'filter', 'genre']:
+                    if args.get(param) is not None:
+                        next_url += param + '=' + str(args.get(param)) + '&'
+                next_url += 'after=' + next_after
+                links['next'] = {
+                    'href': next_url
+                }
+            elif has_next:
+                next_url = 'http://127.0.0.1:5000/tv-shows?'
+                for param in ['order_by', 'page', 'page_size', 'filter', 'genre']:
+                    if args.get(param) is not None or (param == 'page'):
+                        if (param == 'page'):
+                            next_url += 'page' + '=' + str(params['page'] + 1) + '&'
+                        else:
+                            next_url += param + '=' + str(args.get(param)) + '&'
+                next_url = next_url[0:-1]
+                links['next'] = {
+                    'href': next_url
+                }
+            return links, next_after
 
-        # Construct query
-        query = 'select '
-        for field in params['filter']:
-            query += field + ', '
-        query = query[0:-2]
-        query += ' from TV_Shows order by '
-        for field in order_reformatted:
-            query += field + ' ' + order_reformatted[field] + ', '
-        query = query[0:-2]
-        offset = (params['page'] - 1) * params['page_size']
-        query += ' limit ' + str(params['page_size']) + ' offset ' + str(offset)
-        
         # Execute query
-        conn = sqlite3.connect('z5207370.db')
-        result = pd.read_sql_query(query, con=conn)
+        with pool.connection() as conn:
+            with span('sql.list_page', query):
+                rows = conn.execute(query, query_params).fetchall()
 
         # If no results are returned
-        if (result.shape[0] == 0):
+        if (len(rows) == 0):
             return "No TV shows were found matching your search parameters", 404
-        
-        # Construct 'tv_shows' response field
-        tv_shows = []
-        for index, row in result.iterrows():
-            show = {}
-            for field in result.columns:
-                show[field] = row[field]
-            tv_shows.append(show)
-
-        # Construct '_links['self']' response field
-        self_url = 'http://127.0.0.1:5000/tv-shows'
-        if args_check:
-            self_url += '?'
-            for param in ['order_by', 'page', 'page_size', 'filter']:
-                if args.get(param) is not None:
-                    self_url += param + '=' + str(args.get(param)) + '&'
-            self_url = self_url[0:-1]
+        has_next = (len(rows) > params['page_size'])
+        rows = rows[:params['page_size']]
+        links, next_after = page_links(has_next, rows[-1][len(params['filter']):])
+
+        # Construct response, encoding the 'tv_shows' field a chunk of rows at a time
+        # rather than building it as a list of dicts first
+        if cursor:
+            head = {'page_size': params['page_size']}
+            tail = {'after': next_after, '_links': links}
+        else:
+            head = {'page': params['page'], 'page_size': params['page_size']}
+            tail = {'_links': links}
+        decode_show = show_decoder(params['filter'])
+
+        def generate():
+            yield json.dumps(head)[:-1] + ', "tv_shows": ['
+            # Time the encoding only, not the writes to the client between chunks
+            encoding = 0
+            for start in range(0, len(rows), STREAM_CHUNK_SIZE):
+                chunk = rows[start:start + STREAM_CHUNK_SIZE]
+                encode_start = time.perf_counter()
+                chunk = json.dumps([decode_show(row) for row in chunk])[1:-1]
+                encoding += time.perf_counter() - encode_start
+                yield (', ' if start else '') + chunk
+            registry.record('json.list_page', encoding)
+            yield '], ' + json.dumps(tail)[1:]
+
+        response = Response(page_cache.stream(key, version, etag, generate()), status=200,
+                            mimetype='application/json')
+        response.set_etag(etag)
+        response.cache_control.no_cache = True
+        return response
+
+    # Get the TV shows of the ids in the 'ids' parameter in request order, with a marker
+    # for each id no TV show has, reading them with as few queries as possible
+    def get_by_ids(self, args, key, version, etag):
+        try:
+            ids = [int(id) for id in args.get('ids').split(',')]
+            if not all(valid_id(id) for id in ids):
+                raise ValueError(args.get('ids'))
+        except ValueError:
+            return "Parameter 'ids' must be a comma separated list of IDs", 400
+        if (len(ids) > MULTI_GET_LIMIT):
+            return "At most {} TV shows can be retrieved at once".format(MULTI_GET_LIMIT), 400
+        try:
+            fields = parse_filter(args.get('filter') or ','.join(SHOW_COLUMNS))
+        except ValueError as error:
+            return str(error), 400
+
+        # Read each distinct TV show once, selecting its id after the filtered fields
+        unique_ids = list(dict.fromkeys(ids))
+        rows = {}
+        query = 'select ' + ', '.join(fields + ['id']) + ' from TV_Shows where id in'
+        with pool.connection() as conn, span('sql.multi_get'):
+            rows.update((row[-1], row) for row in select_in(conn, query, unique_ids))
+
+        # Decode the JSON fields of the TV shows found only
+        decode_show = show_decoder(fields)
+        with span('json.multi_get'):
+            shows = {id: decode_show(row) for id, row in rows.items()}
+            tv_shows = []
+            for id in ids:
+                if id in shows:
+                    tv_shows.append(shows[id])
+                else:
+                    # 'error' is not a field of TV shows, so it tells missing ones apart whatever the filter
+                    tv_shows.append({
+                        'id': id,
+                        'error': 'not_found',
+                        'message': "TV show of id '{}' doesn't exist".format(id)
+                    })
+            body = json.dumps({
+                'total': len(ids),
+                'found': sum(1 for id in ids if id in shows),
+                'tv_shows': tv_shows,
+                '_links': {
+                    'self': {
+                        'href': 'http://127.0.0.1:5000/tv-shows?' + key
+                    }
+                }
+            })
+        page_cache.set(key, version, etag, body)
+        return page_cache.respond(etag, body)
+
+    @api.response(200, 'Batch Processed, see the status of each TV show')
+    @api.response(400, 'Bad request: invalid or incorrect field(s)')
+    @api.doc(description="Update many TV shows, given as a JSON list of updates with their IDs, in one transaction")
+    @api.expect([show_update_model], validate=True)
+    def patch(self):
+        # Get request payload as column values for each TV show
+        updates = request.json
+        if not isinstance(updates, list):
+            return "Request body must be a list of TV show updates", 400
+        if (len(updates) > BATCH_UPDATE_LIMIT):
+            return "At most {} TV shows can be updated at once".format(BATCH_UPDATE_LIMIT), 400
+        rows = []
+        for update in updates:
+            update = dict(update)
+            id = update.pop('id')
+            try:
+                rows.append((id, show_update_values(update)))
+            except ValueError as error:
+                return "Field '{}' is invalid".format(error), 400
+
+        now = int(time.time())
+
+        with pool.connection() as conn:
+            try:
+                with span('sql.batch_update'), transaction(conn):
+                    # Find which of the TV shows exist
+                    existing = set(id for id, in select_in(conn, 'select id from TV_Shows where id in',
+                                                           set(id for id, values in rows)))
+
+                    # Apply the updates in order, preparing the update once for each run of
+                    # updates of the same fields
+                    found = []
+                    for id, values in rows:
+                        if id in existing:
+                            found.append((tuple(values), dict(values, id=id, last_update=now)))
+                    for columns, run in groupby(found, key=lambda update: update[0]):
+                        conn.executemany(show_update_query(columns), (values for columns, values in run))
+            except sqlite3.IntegrityError:
+                return "An updated TV show name already exists in database", 400
+        if found:
+            invalidate_responses()
+
+        # Generate response
+        results = []
+        for id, values in rows:
+            if id in existing:
+                results.append({
+                    'id': id,
+                    'status': 200,
+                    'last_update': format_update(now),
+                    '_links': {
+                        'self': {
+                            'href': 'http://127.0.0.1:5000/tv-shows/' + str(id)
+                        }
+                    }
+                })
+            else:
+                results.append({
+                    'id': id,
+                    'status': 404,
+                    'message': "TV show of id '{}' doesn't exist".format(id)
+                })
+        response = {
+            'total': len(rows),
+            'updated': len(found),
+            'results': results
+        }
+
+        return response, 200
+
+# Query arguments for searching TV shows
+search_parser = reqparse.RequestParser()
+search_parser.add_argument('q')
+search_parser.add_argument('page')
+search_parser.add_argument('page_size')
+search_parser.add_argument('filter')
+
+# Build an FTS5 query matching the TV shows with each word of 'q' as the prefix of a word of
+# their name or summary; the words are quoted so that FTS5 syntax in 'q' is taken literally
+def search_match(q):
+    words = re.findall(r'\w+', q)
+    if not words:
+        raise ValueError("Parameter 'q' must contain at least one word")
+    return ' '.join('"' + word + '"*' for word in words)
+
+# Take a page of matches from the full-text index in rank order, then read their TV shows
+SEARCH_QUERY = 'select {} from (select rowid, rank from Show_Search where Show_Search match ?\
+                                 order by rank limit ? offset ?) as hits\
+                join TV_Shows on TV_Shows.rowid = hits.rowid\
+                order by hits.rank'
+
+@api.route('/tv-shows/search')
+@api.param('q', 'The words to search for in TV show names and summaries; words match as prefixes')
+@api.param('page', 'The page number')
+@api.param('page_size', 'The page size')
+@api.param('filter', 'The fields to be displayed')
+class ShowsSearch(Resource):
+
+    @api.response(200, 'TV Shows Successfully retrieved')
+    @api.response(400, 'Bad Request')
+    @api.response(404, 'TV Shows not found')
+    @api.doc(description="Search TV shows by name and summary, best matches first")
+    def get(self):
+        # Serve the cached page unless a TV show has changed since it was built
+        key = 'search?' + request.query_string.decode()
+        version, etag, response = cached_page(key)
+        if response is not None:
+            return response
+
+        # Get parameters from query
+        args = search_parser.parse_args()
+        try:
+            page, page_size = parse_page(args.get('page') or '1', args.get('page_size') or '100')
+            match = search_match(args.get('q') or '')
+            fields = parse_filter(args.get('filter') or 'id,name')
+        except ValueError as error:
+            return str(error), 400
+
+        # Get one more TV show than needed to find out whether there is a next page
+        query = SEARCH_QUERY.format(', '.join('TV_Shows.' + field for field in fields))
+        with pool.connection() as conn, span('sql.search', query):
+            rows = conn.execute(query, (match, page_size + 1, (page - 1) * page_size)).fetchall()
+
+        # If no results are returned
+        if (len(rows) == 0):
+            return "No TV shows were found matching your search parameters", 404
+        has_next = (len(rows) > page_size)
+        rows = rows[:page_size]
+
+        # Construct '_links' response field
+        query_args = {param: args.get(param) for param in ['q', 'page', 'page_size', 'filter']
+                      if args.get(param) is not None}
+
+        def page_url(page):
+            return 'http://127.0.0.1:5000/tv-shows/search?' + urllib.parse.urlencode(dict(query_args, page=page))
+
         links = {
             'self': {
-                'href': self_url
+                'href': 'http://127.0.0.1:5000/tv-shows/search?' + urllib.parse.urlencode(query_args)
             }
         }
-        # Construct '_links['previous']' response field if it exists
-        if (params['page'] > 1):
-            prev_url = 'http://127.0.0.1:5000/tv-shows?'
-            for param in ['order_by', 'page', 'page_size', 'filter']:
-                if args.get(param) is not None:
-                    if (param == 'page'):
-                        prev_url += 'page' + '=' + str(params['page'] - 1) + '&'
-                    else:
-                        prev_url += param + '=' + str(args.get(param)) + '&'
-            prev_url = prev_url[0:-1]
+        if (page > 1):
             links['previous'] = {
-                'href': prev_url
+                'href': page_url(page - 1)
             }
-        # Construct '_links['next']' response field if it exists
-        size = pd.read_sql_query('select count(id) as count\
-                                      from TV_Shows', con=conn)
-        if (params['page'] * params['page_size'] < int(size['count'].iloc[0])):
-            next_url = 'http://127.0.0.1:5000/tv-shows?'
-            for param in ['order_by', 'page', 'page_size', 'filter']:
-                if args.get(param) is not None or (param == 'page'):
-                    if (param == 'page'):
-                        next_url += 'page' + '=' + str(params['page'] + 1) + '&'
-                    else:
-                        next_url += param + '=' + str(args.get(param)) + '&'
-            next_url = next_url[0:-1]
+        if has_next:
             links['next'] = {
-                'href': next_url
+                'href': page_url(page + 1)
             }
 
         # Construct response
-        response = {
-            'page': params['page'],
-            'page_size': params['page_size'],
-            'tv_shows': tv_shows,
-            '_links': links
-        }
+        decode_show = show_decoder(fields)
+        with span('json.search'):
+            body = json.dumps({
+                'q': args.get('q'),
+                'page': page,
+                'page_size': page_size,
+                'tv_shows': [decode_show(row) for row in rows],
+                '_links': links
+            })
+        page_cache.set(key, version, etag, body)
+        return page_cache.respond(etag, body)
 
-        return response, 200
+# Number of rows fetched from the cursor at a time when exporting TV shows
+EXPORT_CHUNK_SIZE = 1000
 
-# Query arguments for retrieving a list of available TV shows
-parser.add_argument('format')
-parser.add_argument('by')
+# Query arguments for exporting TV shows
+export_parser = reqparse.RequestParser()
+export_parser.add_argument('format')
+export_parser.add_argument('order_by')
+export_parser.add_argument('filter')
+export_parser.add_argument('genre')
+
+@api.route('/tv-shows/export')
+@api.param('format', "The export format: 'ndjson' (default) or 'csv'")
+@api.param('order_by', 'The way the TV shows are ordered')
+@api.param('filter', 'The fields to be exported (all fields by default)')
+@api.param('genre', 'Only TV shows of this genre')
+class ShowsExport(Resource):
+
+    @api.response(200, 'TV Shows Successfully exported')
+    @api.response(400, 'Bad Request')
+    @api.doc(description="Stream every TV show as NDJSON or CSV")
+    def get(self):
+        # Get parameters from query
+        args = export_parser.parse_args()
+        export_format = args.get('format') or 'ndjson'
+        if export_format not in ['ndjson', 'csv']:
+            return "Format parameter '{}' is invalid".format(export_format), 400
+        try:
+            sort_keys = parse_order_by(args.get('order_by') or '+id')
+            fields = parse_filter(args.get('filter') or ','.join(SHOW_COLUMNS))
+        except ValueError as error:
+            return str(error), 400
+
+        # Construct query
+        query = 'select ' + ', '.join(fields) + ' from TV_Shows'
+        query_params = []
+        if args.get('genre') is not None:
+            query += ' where ' + GENRE_CONDITION
+            query_params.append(args.get('genre'))
+        query += ' order by ' + ', '.join(field + ' ' + direction for field, direction in sort_keys)
+
+        # Encode a chunk of rows; CSV keeps JSON string columns as they are stored
+        header = None
+        if (export_format == 'csv'):
+            def write_csv(rows):
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows)
+                return buffer.getvalue()
+            header = write_csv([fields])
+            update_column = fields.index('last_update') if 'last_update' in fields else None
+
+            def encode(rows):
+                if update_column is not None:
+                    rows = [row[:update_column] + (format_update(row[update_column]),) + row[update_column + 1:]
+                            for row in rows]
+                return write_csv(rows)
+            mimetype = 'text/csv'
+        else:
+            decode_show = show_decoder(fields)
+
+            def encode(rows):
+                return ''.join(json.dumps(decode_show(row)) + '\n' for row in rows)
+            mimetype = 'application/x-ndjson'
+
+        # Stream the rows from the cursor a chunk at a time, so memory use does not
+        # depend on the number of TV shows; the connection is only taken from the
+        # pool once the response starts and is returned when it ends
+        def generate():
+            if header is not None:
+                yield header
+            # Time the query and the encoding only, not the writes to the client between chunks
+            fetching = 0
+            encoding = 0
+            with pool.connection() as conn:
+                rows = conn.execute(query, query_params)
+                while True:
+                    fetch_start = time.perf_counter()
+                    chunk = rows.fetchmany(EXPORT_CHUNK_SIZE)
+                    encode_start = time.perf_counter()
+                    fetching += encode_start - fetch_start
+                    if not chunk:
+                        break
+                    chunk = encode(chunk)
+                    encoding += time.perf_counter() - encode_start
+                    yield chunk
+            registry.record('sql.export', fetching, query)
+            registry.record(export_format + '.export', encoding)
+
+        response = Response(generate(), status=200, mimetype=mimetype)
+        response.headers['Content-Disposition'] = 'attachment; filename=tv-shows.' + export_format
+        return response
+
+# Sort key ordering statistics values as SQLite orders them: null, then numbers, then text
+def value_order(value):
+    return (value is not None, isinstance(value, str), value)
+
+# Query arguments for retrieving statistics of the TV shows
+statistics_parser = reqparse.RequestParser()
+statistics_parser.add_argument('format')
+statistics_parser.add_argument('by')
+statistics_parser.add_argument('window')
+statistics_parser.add_argument('source')
 
 @api.route('/tv-shows/statistics')
 @api.param('format', 'The format the statistics should be presented')
 @api.param('by', 'Statistics breakdown by this attribute')
+@api.param('window', "Count the TV shows updated in this past window, such as '1h', '24h' (default) or '7d'")
+@api.param('source', "Compute the statistics from the statistics counters ('counters', default) or the columnar snapshot ('snapshot')")
 class ShowsStatistics(Resource):
 
     @api.response(200, 'TV Shows Statistics Successfully retrieved')
@@ -501,7 +2035,7 @@ class ShowsStatistics(Resource):
     @api.doc(description="Retrieve statistics of all TV shows based off of a parameter")
     def get(self):
         # Get parameters from query
-        args = parser.parse_args()
+        args = statistics_parser.parse_args()
 
         params = {}
         # Check for invalid or missing parameters
@@ -515,123 +2049,619 @@ class ShowsStatistics(Resource):
             return "By parameter '{}' is invalid".format(by), 400
         else:
             params['by'] = by
+        window = args.get('window') or '24h'
+        try:
+            since = int(time.time()) - parse_window(window)
+        except ValueError:
+            return "Window parameter '{}' is invalid".format(window), 400
+        source = args.get('source') or 'counters'
+        if not source in ['counters', 'snapshot']:
+            return "Source parameter '{}' is invalid".format(source), 400
 
-        # Get the total number of TV shows in the database
-        conn = sqlite3.connect('z5207370.db')
-        total = pd.read_sql_query('select count(id) as count\
-                                       from TV_Shows', con=conn)
-        total = int(total['count'].iloc[0])
-        
-        # Get the total number of TV shows in the database that have been updated in the last 24 hours
-        yesterday = datetime.now() - timedelta(days=1)
-        yesterday = yesterday.strftime('%Y-%m-%d %H:%M:%S')
-        yesterday = pd.read_sql_query("select count(id) as count\
-                                           from TV_Shows\
-                                           where last_update > '" + yesterday + "'", con=conn)
-        updated = int(yesterday['count'].iloc[0])
-
-        # Get the breakdown of the statistics for all the TV shows in the database
-        if (params['by'] != 'genres'):
-            stats = pd.read_sql_query('select ' + params['by'] + ', count(*) as percent\
-                                           from TV_Shows\
-                                           group by ' + params['by'], con=conn)
-            # Error check for empty database
-            if (stats.shape[0] == 0):
-                return "No TV shows have been imported into the database", 404
-            # Add row stating missing data entries if it exists
-            stats_sum = stats['percent'].sum()
-            if (stats_sum < total):
-                df = {
-                    stats_sum.columns[0]: 'Missing data',
-                    'percent': total - stats_sum['percent']
-                }
-                df = pd.DataFrame(data=df)
-                stats_sum = stats_sum.append(df)
-
-            stats['percent'] = stats['percent'].apply(lambda x: x * 100 / total )
+        if (source == 'snapshot'):
+            # Count the TV shows of the columnar snapshot, brought up to date with the table first
+            with pool.connection() as conn:
+                shows = snapshots.current(conn)
+            with span('snapshot.statistics'):
+                total = shows.rows
+                updated = shows.count_updated(since)
+                stats = shows.counts(params['by'])
+            # Order the breakdown as it is ordered from the counters
+            if (params['by'] == 'genres'):
+                stats.sort(key=lambda stat: (-stat[1], value_order(stat[0])))
+            else:
+                stats.sort(key=lambda stat: value_order(stat[0]))
         else:
-            stats = pd.read_sql_query('select genres\
-                                            from TV_Shows', con=conn)
-            # Error check for empty database
-            if (stats.shape[0] == 0):
-                return "No TV shows have been imported into the database", 404
-            stats = stats[stats['genres'] != '[]']
-            # Explode rows in list to multiple rows
-            stats['genres'] = stats['genres'].apply(lambda x: x[1:-1])
-            stats = pd.concat([pd.Series(row['genres'].split(', ')) for index, row in stats.iterrows()]).reset_index()
-            stats.columns = ['index', 'genres']
-            stats = stats[['genres']]
-            # Remove quotation marks for strings
-            stats['genres'] = stats['genres'].apply(lambda x: x[1:-1])
-            # Get the percentage of each genre relative to the entire database
-            stats = stats['genres'].value_counts()
-            stats = stats.to_frame()
-            stats = stats.reset_index()
-            stats.columns = ['genres', 'percent']
-            stats['percent'] = stats['percent'].apply(lambda x: x * 100 / total)
-        
-        # Round percent to 2 decimal places
-        stats['percent'] = stats['percent'].apply(lambda x: round(x, 2))
-        
+            with pool.connection() as conn:
+                # Get the total number of TV shows in the database
+                with span('sql.statistics_total'):
+                    total = conn.execute("select coalesce(sum(count), 0) from Show_Statistics\
+                                              where dimension = 'total'").fetchone()[0]
+
+                # Get the total number of TV shows in the database that have been updated in the window
+                with span('sql.statistics_updated'):
+                    updated = count_updated(conn, since)
+
+                # Get the breakdown of the statistics for all the TV shows in the database from the
+                # counters kept up to date by the TV_Shows triggers; genres are ordered by frequency
+                order = 'count desc, value' if (params['by'] == 'genres') else 'value'
+                with span('sql.statistics_breakdown'):
+                    stats = conn.execute('select value, count from Show_Statistics\
+                                              where dimension = ? and count > 0\
+                                              order by ' + order, (params['by'],)).fetchall()
+
+        # Error check for empty database
+        if (total == 0):
+            return "No TV shows have been imported into the database", 404
+
+        # Get the percentage of each value relative to the entire database, rounded to 2 decimal places
+        stats = [(value, round(count * 100 / total, 2)) for value, count in stats]
+
         # Construct response for JSON
         if (params['format'] == 'json'):
             values = {}
-            for index, row in stats.iterrows():
-                values[row[row.index[0]]] = row['percent']
+            for value, percent in stats:
+                values[value] = percent
             response = {
                 'total': total,
                 'total_updated': updated,
+                'window': window,
                 'values': values
             }
             return response, 200
         # Construct response for image
         else:
-            # Generate labels and title
-            labels = stats[stats.columns[0]].tolist()
-            for i in range(len(labels)):
-                labels[i] += ' (' + str(stats['percent'].iloc[i]) + '%)'
-            title = 'Percentage distribution of {} of all movies in the database'.format(params['by'])
-            # Pie charts for language, status and type
-            if (params['by'] != 'genres'):
-                ax = stats.plot.pie(y='percent', figsize=(15, 10), labels=labels, title=title)
-                ax.set_ylabel('')
-                ax.annotate('Total number of TV shows in database: ' + str(total), (1, -1), weight='bold')
-                ax.annotate('Total number of TV updated in the past 24 hours: ' + str(updated), (1, -1.05), weight='bold')
-            # Bar chart for genres
+            # The chart only depends on the statistics, so they identify the rendered PNG
+            key = chart_key(params['by'], total, updated, window, stats)
+            if request.if_none_match.contains_weak(key):
+                response = Response(status=304)
             else:
-                ax = stats.plot(kind='bar', x='genres', y='percent', figsize=(15, 10), rot=0)
-                ax.set_xlabel('Genres', weight='bold')
-                ax.set_ylabel('Percentage', weight='bold')
-                plt.title(title, weight='bold')
-                plt.legend(labels=[])
-                plt.subplots_adjust(right=0.8)
-                ax.annotate('Total number of TV \nshows in database: ' + str(total), (1210, 150), weight='bold', xycoords='figure pixels')
-                ax.annotate('Total number of TV \nupdated in the past 24 hours: ' + str(updated), (1210, 100), weight='bold', xycoords='figure pixels')
-
-            plt.savefig('q6.png')
-            
-            return send_file('q6.png', cache_timeout=0)
+                response = Response(charts.get(key, params['by'], total, updated, window, stats),
+                                    mimetype='image/png')
+            response.set_etag(key)
+            # Clients may keep the chart but must revalidate it on every poll
+            response.cache_control.no_cache = True
+            return response
+
+# Most buckets a time series of updates can have
+UPDATE_BUCKETS_LIMIT = 1000
+
+# Query arguments for retrieving the time series of updates
+updates_parser = reqparse.RequestParser()
+updates_parser.add_argument('window')
+updates_parser.add_argument('bucket')
+
+@api.route('/tv-shows/statistics/updates')
+@api.param('window', "The past window the time series covers, such as '24h' (default) or '7d'")
+@api.param('bucket', "The length of each bucket, a whole number of hours such as '1h' (default) or '1d'")
+class ShowsUpdateStatistics(Resource):
+
+    @api.response(200, 'TV Show Updates Successfully retrieved')
+    @api.response(400, 'Bad Request')
+    @api.doc(description="Retrieve the number of TV shows by the time they were last updated, in buckets")
+    def get(self):
+        # Get parameters from query
+        args = updates_parser.parse_args()
+        window = args.get('window') or '24h'
+        bucket = args.get('bucket') or '1h'
+        try:
+            window_seconds = parse_window(window)
+        except ValueError:
+            return "Window parameter '{}' is invalid".format(window), 400
+        try:
+            bucket_seconds = parse_window(bucket)
+        except ValueError:
+            bucket_seconds = None
+        # Buckets are sums of the hourly Update_Hours counters
+        if (bucket_seconds is None) or (bucket_seconds % 3600 != 0):
+            return "Bucket parameter '{}' is invalid: it must be a whole number of hours".format(bucket), 400
+        if (window_seconds // bucket_seconds > UPDATE_BUCKETS_LIMIT):
+            return "At most {} buckets can be retrieved at once".format(UPDATE_BUCKETS_LIMIT), 400
+
+        # The buckets are aligned on multiples of their length since the epoch, from the one
+        # the window starts in to the current one
+        now = int(time.time())
+        first = (now - window_seconds) // bucket_seconds * bucket_seconds
+        counts = [0] * ((now - first) // bucket_seconds + 1)
+        with pool.connection() as conn, span('sql.statistics_updates'):
+            for hour, count in conn.execute('select hour, count from Update_Hours where hour between ? and ?',
+                                            (first // 3600, now // 3600)):
+                counts[(hour * 3600 - first) // bucket_seconds] += count
+
+        # Construct response
+        response = {
+            'window': window,
+            'bucket': bucket,
+            'total': sum(counts),
+            'buckets': [{'start': format_update(first + index * bucket_seconds), 'count': count}
+                        for index, count in enumerate(counts)],
+            '_links': {
+                'self': {
+                    'href': 'http://127.0.0.1:5000/tv-shows/statistics/updates?'
+                            + urllib.parse.urlencode({'window': window, 'bucket': bucket})
+                }
+            }
+        }
+        return response, 200
+
+# Version of the statistics chart: a digest of everything drawn on it
+def chart_key(by, total, updated, window, stats):
+    data = json.dumps([by, total, updated, window, stats], separators=(',', ':'))
+    return hashlib.sha1(data.encode()).hexdigest()
+
+# Draw the statistics chart and return it as PNG bytes
+def render_chart(by, total, updated, window, stats):
+    # pandas and matplotlib are only imported once a chart is drawn, since they take most
+    # of the time and memory a worker needs to start and no other request uses them
+    import matplotlib
+    # Render charts off-screen; the interactive backends are not thread-safe
+    matplotlib.use('Agg')
+    import pandas as pd
+    from matplotlib.figure import Figure
+
+    # Generate labels and title; TV shows without a value are shown as missing data
+    labels = []
+    for value, percent in stats:
+        labels.append('{} ({}%)'.format('Missing data' if value is None else value, percent))
+    stats = pd.DataFrame(stats, columns=[by, 'percent'])
+    title = 'Percentage distribution of {} of all movies in the database'.format(by)
+    # The figure is not registered with pyplot and is released with the last reference to it
+    figure = Figure(figsize=(15, 10))
+    ax = figure.add_subplot()
+    # Pie charts for language, status and type
+    if (by != 'genres'):
+        stats.plot.pie(y='percent', ax=ax, labels=labels, title=title)
+        ax.set_ylabel('')
+        ax.annotate('Total number of TV shows in database: ' + str(total), (1, -1), weight='bold')
+        ax.annotate('Total number of TV updated in the past ' + window + ': ' + str(updated), (1, -1.05), weight='bold')
+    # Bar chart for genres
+    else:
+        stats.plot(kind='bar', x='genres', y='percent', ax=ax, rot=0)
+        ax.set_xlabel('Genres', weight='bold')
+        ax.set_ylabel('Percentage', weight='bold')
+        ax.set_title(title, weight='bold')
+        ax.legend(labels=[])
+        figure.subplots_adjust(right=0.8)
+        ax.annotate('Total number of TV \nshows in database: ' + str(total), (1210, 150), weight='bold', xycoords='figure pixels')
+        ax.annotate('Total number of TV \nupdated in the past ' + window + ': ' + str(updated), (1210, 100), weight='bold', xycoords='figure pixels')
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png')
+    figure.clear()
+    return buffer.getvalue()
+
+# Renders statistics charts on one background thread and keeps the latest PNGs in memory;
+# requests for a chart that is already being rendered wait for the same render
+class ChartRenderer:
+
+    def __init__(self, cache_size=CHART_CACHE_SIZE, cache_ttl=CHART_CACHE_TTL):
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chart')
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.renders = 0
+
+    def _render(self, key, *args):
+        try:
+            with span('chart.render'):
+                png = render_chart(*args)
+            self.cache.set(key, png)
+            with self._lock:
+                self.renders += 1
+            return png
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+    # Return the PNG of chart 'key', rendering it from 'args' if it is not cached
+    def get(self, key, *args):
+        png = self.cache.get(key)
+        if png is not None:
+            return png
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render, key, *args)
+                self._pending[key] = future
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'renders': self.renders,
+                'pending': len(self._pending)
+            }
+        stats['cache'] = self.cache.stats()
+        return stats
+
+charts = ChartRenderer()
+
+# Columnar snapshot of the TV_Shows table that statistics can be computed from. The snapshot
+# file is shared by the processes serving the database: a process maps it, and when the table
+# has changed since, brings it up to date from the changed rows and replaces the file.
+# numpy is only imported once a snapshot is used
+class SnapshotStore:
+
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        # The snapshot in use and the file it was mapped from
+        self._snapshot = None
+        self._file = None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.updates = 0
+
+    # Path of the snapshot file of the current database
+    def file(self):
+        return self.path or pool.database + '.snapshot'
+
+    # Return a snapshot at least as recent as the current version of the TV_Shows table
+    def current(self, conn):
+        import snapshot
+        version = table_version(conn)
+        path = self.file()
+        with self._lock:
+            if (self._file == path) and (self._snapshot.version >= version):
+                return self._snapshot
+            # Another process may have brought the file up to date already
+            shows = None
+            if os.path.exists(path):
+                try:
+                    shows = snapshot.load(path)
+                except (ValueError, KeyError) as exception:
+                    snapshot_log.warning('Rebuilding the snapshot %s: %s', path, exception)
+            if (shows is None) or (shows.version < version):
+                if shows is None:
+                    with span('snapshot.build'):
+                        shows = snapshot.build(conn)
+                    self.builds += 1
+                else:
+                    with span('snapshot.update'):
+                        shows = snapshot.update(shows, conn)
+                    self.updates += 1
+                shows.save(path)
+                shows = snapshot.load(path)
+            self._snapshot, self._file = shows, path
+            return shows
+
+    def stats(self):
+        with self._lock:
+            return {
+                'builds': self.builds,
+                'updates': self.updates,
+                'version': self._snapshot.version if self._snapshot else None,
+                'rows': self._snapshot.rows if self._snapshot else 0,
+                'bytes': self._snapshot.nbytes if self._snapshot else 0
+            }
+
+snapshot_log = logging.getLogger('tv_shows.snapshot')
+snapshots = SnapshotStore()
+
+# Columns the background refresh keeps in step with tvmaze; the name is left as imported
+# since it identifies the TV show for duplicate detection
+REFRESH_COLUMNS = [column for column in UPDATE_COLUMNS if column != 'name']
+
+# Refresh the TV show columns that changed since the TV show was read at 'previous_update',
+# so that a concurrent patch is never overwritten
+def refresh_query(columns):
+    return show_update_query(columns) + ' and last_update = :previous_update'
+
+# Walks the TV shows from the stalest, in cycles: a cycle checks every TV show not updated
+# for 'interval' seconds when it started, refetching them by tvmaze id and writing only the
+# fields that changed; the position in the cycle is saved with every batch of changes
+class ShowRefresher:
+
+    def __init__(self, interval=REFRESH_INTERVAL, batch_size=REFRESH_BATCH_SIZE,
+                 workers=REFRESH_WORKERS, rate=REFRESH_RATE, idle=REFRESH_IDLE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.idle = idle
+        self.limiter = TokenBucket(rate, max(1, workers))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='refresh')
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.checked = 0
+        self.changed = 0
+        self.errors = 0
+        self.queue_depth = None
+        self.lag = None
+
+    def _count(self, **counts):
+        with self._lock:
+            for counter, count in counts.items():
+                setattr(self, counter, getattr(self, counter) + count)
+
+    def _fetch(self, tvmaze_id):
+        self.limiter.acquire()
+        with span('tvmaze.get_show'):
+            return tvmaze.get_show(tvmaze_id)
+
+    # Get the state of the current cycle, starting a new cycle once the previous one
+    # finished and 'interval' seconds have passed since it started
+    def _cycle(self, conn, now):
+        cycle_start, finished, last_update, id = conn.execute(
+            "select cycle_start, finished, last_update, id from Refresh_State\
+                 where name = 'TV_Shows'").fetchone()
+        if (cycle_start is None) or (finished is not None and cycle_start <= now - self.interval):
+            cycle_start, finished, last_update, id = now, None, None, None
+            conn.execute("update Refresh_State set cycle_start = ?, finished = null, last_update = null, id = null\
+                              where name = 'TV_Shows'", (cycle_start,))
+        return cycle_start, finished, last_update, id
+
+    # Condition and parameters matching the TV shows left in the current cycle
+    def _remaining(self, cycle_start, last_update, id):
+        condition = 'last_update < ?'
+        params = [cycle_start - self.interval]
+        if last_update is not None:
+            condition += ' and (last_update, id) > (?, ?)'
+            params += [last_update, id]
+        return condition, params
+
+    # Record the number of TV shows left in the current cycle and the age of the stalest one
+    def _measure(self, conn, now, cycle_start, last_update, id):
+        condition, params = self._remaining(cycle_start, last_update, id)
+        with span('sql.refresh_measure'):
+            depth = conn.execute('select count(*) from TV_Shows where ' + condition, params).fetchone()[0]
+            stalest = conn.execute('select last_update from TV_Shows where ' + condition
+                                   + ' order by last_update, id limit 1', params).fetchone()
+        lag = None
+        if stalest is not None:
+            lag = now - stalest[0]
+        with self._lock:
+            self.queue_depth = depth
+            self.lag = lag
+
+    # Refresh the next batch of stale TV shows and return how many were checked,
+    # 0 if there is nothing left to refresh in this cycle or tvmaze is unavailable
+    def run_once(self):
+        now = int(time.time())
+        with pool.connection() as conn:
+            cycle_start, finished, last_update, id = self._cycle(conn, now)
+            if finished is not None:
+                self._measure(conn, now, cycle_start, last_update, id)
+                return 0
+            condition, params = self._remaining(cycle_start, last_update, id)
+            with span('sql.refresh_select'):
+                rows = conn.execute('select id, tvmaze_id, last_update, ' + ', '.join(REFRESH_COLUMNS)
+                                    + ' from TV_Shows where ' + condition
+                                    + ' order by last_update, id limit ?', params + [self.batch_size]).fetchall()
+            if not rows:
+                conn.execute("update Refresh_State set finished = ? where name = 'TV_Shows'", (now,))
+                self._measure(conn, now, cycle_start, last_update, id)
+                return 0
+
+        # Fetch the TV shows from tvmaze concurrently, stopping at the first failure so that
+        # the TV shows from there on are retried by the next batch
+        fetches = [self._executor.submit(self._fetch, row[1]) for row in rows]
+        checked = []
+        updates = []
+        errors = 0
+        for row, fetch in zip(rows, fetches):
+            try:
+                show = fetch.result()
+            except UpstreamError as error:
+                # A TV show removed from tvmaze keeps its last known values
+                if (error.status != 404):
+                    errors += 1
+                    break
+                show = None
+            checked.append(row)
+            if show is not None:
+                record = ShowRecord.from_tvmaze(show)
+                values = {column: getattr(record, column) for column in REFRESH_COLUMNS}
+                stored = dict(zip(REFRESH_COLUMNS, row[3:]))
+                changed = {column: value for column, value in values.items() if value != stored[column]}
+                if changed:
+                    updates.append((tuple(changed), dict(changed, id=row[0], previous_update=row[2])))
+        for fetch in fetches[len(checked) + errors:]:
+            fetch.cancel()
+
+        # Write the changes and move the cycle past the checked TV shows in one transaction;
+        # the fetches may have taken a while, so the changes are timed when they are written
+        changed = 0
+        if checked:
+            with pool.connection() as conn:
+                now = int(time.time())
+                with span('sql.refresh_batch'), transaction(conn):
+                    for columns, run in groupby(updates, key=lambda update: update[0]):
+                        changed += conn.executemany(refresh_query(columns),
+                                                    (dict(values, last_update=now) for columns, values in run)).rowcount
+                    last_update, id = checked[-1][2], checked[-1][0]
+                    conn.execute("update Refresh_State set last_update = ?, id = ? where name = 'TV_Shows'",
+                                 (last_update, id))
+                self._measure(conn, now, cycle_start, last_update, id)
+            if changed:
+                invalidate_responses()
+        self._count(batches=1, checked=len(checked), changed=changed, errors=errors)
+        return len(checked)
+
+    # Refresh batches until the current cycle is over or 'stop' is set
+    def run_cycle(self, stop=None):
+        while (stop is None or not stop.is_set()) and self.run_once():
+            pass
+
+    # Refresh TV shows in the calling thread until stop() is called
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                self.run_cycle(self._stop)
+            except Exception:
+                refresh_log.exception('Refreshing TV shows failed')
+                self._count(errors=1)
+            # Wait before checking again for a new cycle or for tvmaze to recover
+            self._stop.wait(self.idle)
+
+    # Run the refresh in a background thread until stop() is called
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self.run_forever, name='refresh', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'running': self._thread is not None,
+                'batches': self.batches,
+                'checked': self.checked,
+                'changed': self.changed,
+                'errors': self.errors,
+                'queue_depth': self.queue_depth,
+                'lag_seconds': self.lag
+            }
+        stats['rate_limit'] = self.limiter.stats()
+        return stats
+
+refresh_log = logging.getLogger('tv_shows.refresh')
+refresher = ShowRefresher()
+
+@api.route('/metrics')
+@api.param('format', "'json' for the runtime statistics only, as JSON")
+class Metrics(Resource):
+
+    @api.response(200, 'Metrics Successfully retrieved')
+    @api.doc(description="Retrieve the latency histograms and runtime statistics of the service in the Prometheus text format")
+    def get(self):
+        response = {
+            'database_pool': pool.stats(),
+            'tvmaze': tvmaze.stats(),
+            'statistics_charts': charts.stats(),
+            'refresh': refresher.stats(),
+            'import_jobs': import_queue.stats(),
+            'snapshot': snapshots.stats(),
+            'response_cache': {
+                'shows': show_cache.stats(),
+                'pages': page_cache.stats()
+            }
+        }
+        if (request.args.get('format') == 'json'):
+            return response, 200
+
+        # Export the runtime statistics as gauges after the latency histograms
+        return Response(registry.render(flatten_stats(response)), status=200,
+                        content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@click.command('init-db')
+def init_db_command():
+    # Create or migrate the database schema
+    init_database()
+    print('Database initialised')
+
+@click.command('rebuild-statistics')
+def rebuild_statistics_command():
+    # Recompute the statistics counters from the TV_Shows table
+    with pool.connection() as conn, transaction(conn):
+        rebuild_statistics(conn)
+    print('Statistics rebuilt')
+
+@click.command('check-statistics')
+def check_statistics_command():
+    # Compare the statistics counters with a full count of the TV_Shows table
+    with pool.connection() as conn:
+        mismatches = check_statistics(conn)
+    for dimension, value, counter, count in mismatches:
+        print("{} '{}': counter {}, actual {}".format(dimension, value, counter, count))
+    if mismatches:
+        raise SystemExit(1)
+    print('Statistics are consistent')
+
+@click.command('export-snapshot')
+@click.argument('path', required=False)
+def export_snapshot_command(path):
+    # Write the columnar snapshot of the TV_Shows table, updating the file if it is already there
+    store = SnapshotStore(path) if path else snapshots
+    with pool.connection() as conn:
+        shows = store.current(conn)
+    print('Snapshot of {} TV shows written to {}'.format(shows.rows, store.file()))
+
+@click.command('refresh-shows')
+def refresh_shows_command():
+    # Refresh stale TV shows from tvmaze until the current refresh cycle is over
+    refresher.run_cycle()
+    stats = refresher.stats()
+    print('Checked {} TV shows, {} changed, {} errors'.format(stats['checked'], stats['changed'], stats['errors']))
+    if stats['errors']:
+        raise SystemExit(1)
+
+# Create the application serving the API. The connection pool, caches, import queue and
+# refresh are module state shared by the resources, so a process serves a single database,
+# TV_SHOWS_DATABASE; run one process per database to serve several
+def create_app():
+    app = Flask(__name__)
+    api.init_app(app)
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    for command in [init_db_command, rebuild_statistics_command, check_statistics_command,
+                    export_snapshot_command, refresh_shows_command]:
+        app.cli.add_command(command)
+    return app
+
+app = create_app()
+
+# Serve the API with gunicorn, forking 'workers' processes of 'threads' threads each, or
+# with a single multi-threaded process if gunicorn is not installed. The schema is set
+# up once beforehand, and the background refresh, if enabled, runs in a process of its own
+def serve(bind=SERVE_BIND, workers=SERVE_WORKERS, threads=SERVE_THREADS):
+    init_database()
+    import_queue.recover()
+    # Each process opens its own connections
+    pool.close()
+    if REFRESH_ENABLED:
+        multiprocessing.get_context('fork').Process(target=refresher.run_forever, name='refresh',
+                                                    daemon=True).start()
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        from werkzeug.serving import make_server
+        host, _, port = bind.rpartition(':')
+        if (workers > 1):
+            logging.warning('gunicorn is not installed, serving with a single process')
+        import_queue.resume()
+        make_server(host or '127.0.0.1', int(port), app, threaded=True).serve_forever()
+        return
+
+    class Server(BaseApplication):
+
+        def load_config(self):
+            self.cfg.set('bind', [bind])
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+
+        # Each worker gets the application forked from this process, connecting to the
+        # database on first use, and runs the pending imports
+        def load(self):
+            import_queue.resume()
+            return app
+
+    Server().run()
 
 if __name__ == '__main__':
-    conn = sqlite3.connect('z5207370.db')
-    c = conn.cursor()
-    c.execute('create table if not exists TV_Shows (\
-                   tvmaze_id integer not null check (tvmaze_id >= 0),\
-                   id integer not null unique check (id >= 0),\
-                   last_update datetime not null,\
-                   name varchar(255) not null,\
-                   type varchar(255),\
-                   language varchar(255),\
-                   genres varchar(255),\
-                   status varchar(255),\
-                   runtime integer,\
-                   premiered varchar(255),\
-                   officialSite varchar(255),\
-                   schedule varchar(255),\
-                   rating integer,\
-                   weight integer,\
-                   network varchar(1000),\
-                   summary varchar(1000))')
-    conn.commit()
-    conn.close()
-    app.run(debug=True)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Serve the TV Shows API')
+    parser.add_argument('--bind', default=SERVE_BIND, help='address to listen on, as host:port')
+    parser.add_argument('--workers', type=int, default=SERVE_WORKERS, help='number of worker processes')
+    parser.add_argument('--threads', type=int, default=SERVE_THREADS, help='number of threads per worker')
+    parser.add_argument('--dev', action='store_true', help='run the development server with the reloader')
+    arguments = parser.parse_args()
+    if arguments.dev:
+        init_database()
+        # Run background work in the serving process only, not in the reloader's watcher process
+        if (os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+            import_queue.resume()
+            if REFRESH_ENABLED:
+                refresher.start()
+        else:
+            import_queue.recover()
+        app.run(debug=True)
+    else:
+        serve(arguments.bind, arguments.workers, arguments.threads)
\ No newline at end of file